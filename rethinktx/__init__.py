@@ -13,11 +13,21 @@
 #    under the License.
 
 from .exceptions import DatabaseException, OptimisticLockFailure, NotFound
+from .pool import ConnectionPool
+from .resolver import IntentResolver
+from .retry import ExponentialBackoff, run_in_transaction, transactional
 from .transaction import Transaction
+from .watcher import AbortWatcher
 
 __all__ = [
+    'AbortWatcher',
+    'ConnectionPool',
     'DatabaseException',
+    'ExponentialBackoff',
     'OptimisticLockFailure',
     'NotFound',
-    'Transaction'
+    'IntentResolver',
+    'Transaction',
+    'run_in_transaction',
+    'transactional',
 ]
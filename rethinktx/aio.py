@@ -0,0 +1,289 @@
+# Copyright 2016, Anton Frolov <frolov.anton@gmail.com>
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import asyncio
+import logging
+import uuid
+
+import rethinkdb
+
+from rethinktx import exceptions
+from rethinktx import low_level
+from rethinktx.transaction import MISSING, STATE_ABORTED, STATE_COMMITTED, \
+    STATE_PENDING, VersionedDocument
+
+LOG = logging.getLogger(__name__)
+
+
+async def run_query(query, conn):
+    return await low_level.run_query(query, conn)
+
+
+async def create_tx(conn):
+    xid = str(uuid.uuid4())
+    result = await run_query(low_level.create_tx_query(xid), conn)
+    return low_level.create_tx_result(xid, result)[0]
+
+
+async def write(conn, xid, table, key, old_xid, document):
+    result = await run_query(
+        low_level.write_query(xid, table, key, old_xid, document), conn)
+    if result['errors'] != 0:
+        raise exceptions.OptimisticLockFailure(xid)
+
+
+async def read(conn, table, key, default=None):
+    while True:
+        result = await run_query(low_level.resolve_read_query(table, key),
+                                 conn)
+        if 'tx' in result:
+            await abort(conn, result['tx']['id'])
+            continue
+        record = low_level.read_result(result)
+        if record is None:
+            return None, default
+        if record['intent'] is None:
+            return record['xid'], record.get('value', default)
+        await run_query(low_level.resolve_intent_query(
+            table, key, record['xid'],
+            low_level.status_cache.get(record['xid']) == 'committed'), conn)
+
+
+async def read_many(conn, table, keys, default=None):
+    keys = low_level.unique(keys)
+    results = {}
+    while keys:
+        # Streams come back as cursors that can only be iterated
+        # asynchronously, so results are fetched as arrays instead
+        records = await run_query(
+            table.get_all(*keys).coerce_to('array'), conn)
+        dirty = low_level.collect_records(keys, records, results, default)
+        if not dirty:
+            break
+        statuses = await tx_statuses(conn, set(dirty.values()))
+        await run_query(low_level.resolve_intents_query(table, [
+            [key, record_xid, statuses[record_xid] == 'committed']
+            for key, record_xid in dirty.items()]), conn)
+        keys = list(dirty)
+    return results
+
+
+async def tx_statuses(conn, xids):
+    statuses, unknown = low_level.cached_statuses(xids)
+    if unknown:
+        pending = low_level.tx_statuses_result(
+            unknown,
+            await run_query(low_level.TX_TBL.get_all(*unknown).coerce_to(
+                'array'), conn),
+            statuses)
+        if pending:
+            statuses.update(await abort_many(
+                conn, [tx['id'] for tx in pending]))
+    return statuses
+
+
+async def commit(conn, xid, changes):
+    return low_level.commit_result(
+        xid, await run_query(low_level.commit_query(xid, changes), conn))
+
+
+async def abort(conn, xid):
+    return low_level.abort_result(
+        xid, await run_query(low_level.abort_query(xid), conn))
+
+
+async def abort_many(conn, xids):
+    return low_level.abort_many_result(
+        xids, await run_query(low_level.abort_many_query(xids), conn))
+
+
+async def clear(conn, xid, committed, table, keys):
+    await asyncio.gather(*[
+        run_query(low_level.clear_query(xid, committed, table, chunk), conn)
+        for chunk in low_level.chunks(keys, low_level.CLEAR_CHUNK_SIZE)])
+
+
+class AsyncTable(object):
+    def __init__(self, tx, name):
+        self.tx = tx
+        self.name = name
+        self.table = rethinkdb.table(name)
+
+    def _check_state(self):
+        if self.tx.state is not STATE_PENDING:
+            raise RuntimeError('Transaction in state "{state}" use is '
+                               'prohibited'.format(state=self.tx.state))
+
+    async def _read(self, key, default=None):
+        self._check_state()
+
+        tx = self.tx
+        vd = tx._lookup(self.name, key)
+        if vd is None:
+            xid, doc = await read(tx.conn, self.table, key, default=MISSING)
+            if doc is not MISSING:
+                vd = VersionedDocument(xid, doc)
+                tx._memoize(self.name, key, vd)
+            else:
+                return VersionedDocument(xid, default)
+        return vd
+
+    async def _read_many(self, keys, default=None):
+        self._check_state()
+
+        tx = self.tx
+        result = {}
+        missing = []
+        for key in keys:
+            vd = tx._lookup(self.name, key)
+            if vd is None:
+                missing.append(key)
+            else:
+                result[key] = vd
+        if missing:
+            records = await read_many(tx.conn, self.table, missing,
+                                      default=MISSING)
+            for key, (xid, doc) in records.items():
+                if doc is not MISSING:
+                    vd = VersionedDocument(xid, doc)
+                    tx._memoize(self.name, key, vd)
+                else:
+                    vd = VersionedDocument(xid, default)
+                result[key] = vd
+        return result
+
+    async def _write(self, key, old_vd, new_doc):
+        self._check_state()
+
+        tx = self.tx
+        await write(tx.conn, await tx._begin(), self.table, key, old_vd.xid,
+                    new_doc)
+        tx.writes.setdefault(self.name, set()).add(key)
+        tx._memoize(self.name, key, VersionedDocument(tx.xid, new_doc))
+
+    async def get(self, key, default=MISSING):
+        vd = await self._read(key, default)
+        if vd.doc is MISSING:
+            raise exceptions.NotFound(key)
+        else:
+            return vd.doc
+
+    async def get_many(self, keys, default=MISSING):
+        result = {}
+        for key, vd in (await self._read_many(keys, default)).items():
+            if vd.doc is MISSING:
+                raise exceptions.NotFound(key)
+            result[key] = vd.doc
+        return result
+
+    async def put(self, key, doc):
+        old_vd = await self._read(key)
+        await self._write(key, old_vd, doc)
+
+    async def update(self, key, data):
+        old_vd = await self._read(key, MISSING)
+        if old_vd.doc is MISSING:
+            raise exceptions.NotFound(self.name, key)
+        doc = dict(old_vd.doc)
+        doc.update(data)
+        await self._write(key, old_vd, doc)
+
+
+class AsyncTransaction(object):
+    def __init__(self, conn, db=None):
+        if db is not None:
+            conn.use(db)
+        self.session = {}
+        self.writes = {}
+        self.conn = conn
+        self.xid = None
+        self.state = STATE_PENDING
+        self._creating = None
+
+    async def begin(self):
+        return self
+
+    async def _begin(self):
+        if self.xid is None:
+            # Concurrent writers wait for the same record to be created
+            if self._creating is None:
+                self._creating = asyncio.ensure_future(create_tx(self.conn))
+            try:
+                xid = await self._creating
+            except Exception:
+                self._creating = None
+                raise
+            if self.xid is None:
+                self.xid = xid
+                LOG.debug('Started transaction #%s', self.xid)
+        return self.xid
+
+    def table(self, name):
+        return AsyncTable(self, name)
+
+    def _lookup(self, table_name, key):
+        table = self.session.get(table_name)
+        if table is None:
+            return None
+        return table.get(key)
+
+    def _memoize(self, table_name, key, vd):
+        self.session.setdefault(table_name, {})[key] = vd
+
+    async def _clear(self, committed, writes_keys):
+        await asyncio.gather(*[
+            clear(self.conn, self.xid, committed, rethinkdb.table(table_name),
+                  keys)
+            for table_name, keys in writes_keys.items()])
+
+    async def commit(self):
+        if self.xid is None:
+            LOG.debug('Finishing transaction without writes')
+            self.state = STATE_COMMITTED
+            return
+
+        LOG.debug('Committing transaction #%s: writes=%s', self.xid,
+                  repr(self.writes))
+
+        if await commit(self.conn, self.xid, self.writes):
+            self.state = STATE_COMMITTED
+            await self._clear(True, self.writes)
+        else:
+            await self.abort()
+            raise exceptions.OptimisticLockFailure(self.xid)
+
+    async def abort(self):
+        if self.xid is None:
+            LOG.debug('Aborting transaction without writes')
+            self.state = STATE_ABORTED
+            return
+
+        LOG.debug('Aborting transaction #%s', self.xid)
+        if await abort(self.conn, self.xid):
+            self.state = STATE_ABORTED
+            await self._clear(False, self.writes)
+        else:
+            raise exceptions.OptimisticLockFailure(self.xid)
+
+    async def __aenter__(self):
+        return await self.begin()
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        if self.state == STATE_PENDING:
+            if exc_val is not None:
+                LOG.debug('Aborting transaction #%s due to exception',
+                          self.xid, exc_info=(exc_type, exc_val, exc_tb))
+                await self.abort()
+            else:
+                await self.commit()
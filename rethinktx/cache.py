@@ -0,0 +1,56 @@
+# Copyright 2016, Anton Frolov <frolov.anton@gmail.com>
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import collections
+import threading
+
+TERMINAL_STATES = frozenset(['committed', 'aborted'])
+
+
+class StatusCache(object):
+    def __init__(self, max_size=10000):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._statuses = collections.OrderedDict()
+
+    def get(self, xid):
+        with self._lock:
+            status = self._statuses.pop(xid, None)
+            if status is None:
+                self.misses += 1
+            else:
+                self._statuses[xid] = status
+                self.hits += 1
+            return status
+
+    def put(self, xid, status):
+        # Only final states can be cached since they never change
+        if status not in TERMINAL_STATES:
+            return
+        with self._lock:
+            self._statuses.pop(xid, None)
+            self._statuses[xid] = status
+            while len(self._statuses) > self.max_size:
+                self._statuses.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._statuses.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def __len__(self):
+        return len(self._statuses)
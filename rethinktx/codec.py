@@ -0,0 +1,47 @@
+# Copyright 2016, Anton Frolov <frolov.anton@gmail.com>
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import json
+import zlib
+
+import rethinkdb
+
+
+class Passthrough(object):
+    def encode(self, doc):
+        return doc
+
+    def decode(self, data):
+        return data
+
+
+# Stores documents as compressed JSON in binary field of tagged object.
+# Documents must be JSON serializable and are opaque to ReQL queries.
+class Zlib(Passthrough):
+    def __init__(self, level=6):
+        self.level = level
+
+    def encode(self, doc):
+        data = json.dumps(doc, separators=(',', ':')).encode('utf-8')
+        return {'$codec': 'zlib',
+                'data': rethinkdb.binary(zlib.compress(data, self.level))}
+
+    def decode(self, data):
+        # Documents written before codec was configured are left as is
+        if not isinstance(data, dict) or data.get('$codec') != 'zlib':
+            return data
+        return json.loads(zlib.decompress(data['data']).decode('utf-8'))
+
+
+PASSTHROUGH = Passthrough()
@@ -0,0 +1,91 @@
+# Copyright 2016, Anton Frolov <frolov.anton@gmail.com>
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import time
+
+from rethinktx import exceptions
+from rethinktx import low_level
+
+WAIT = 'wait'
+WOUND = 'wound'
+DIE = 'die'
+
+
+# Read procedure behaves this way when no policy is given
+class AbortPolicy(object):
+    def resolve(self, conn, priority, owners, xid=None):
+        return low_level.abort_pending(conn, owners)
+
+
+class WaitPolicy(AbortPolicy):
+    def __init__(self, max_wait=0.1, poll_interval=0.005):
+        self.max_wait = max_wait
+        self.poll_interval = poll_interval
+
+    def resolve(self, conn, priority, owners, xid=None):
+        to_wait = []
+        to_abort = []
+        for owner in owners:
+            # Requester without transaction record has no intents written,
+            # so it can't be part of a deadlock and may always wait
+            if priority is None:
+                decision = WAIT
+            else:
+                decision = self._decide(priority, owner['priority'])
+            if decision == DIE:
+                raise exceptions.OptimisticLockFailure(xid)
+            elif decision == WAIT:
+                to_wait.append(owner)
+            else:
+                to_abort.append(owner)
+
+        statuses = {}
+        if to_wait:
+            statuses.update(self._wait(conn, to_wait))
+            to_abort.extend(owner for owner in to_wait
+                            if statuses[owner['id']] == 'pending')
+        if to_abort:
+            statuses.update(low_level.abort_pending(conn, to_abort))
+        return statuses
+
+    # Any owner is given max_wait to finish before it is aborted
+    def _decide(self, priority, owner_priority):
+        return WAIT
+
+    def _wait(self, conn, owners):
+        xids = [owner['id'] for owner in owners]
+        deadline = time.time() + self.max_wait
+        while True:
+            statuses, unknown = low_level.cached_statuses(xids)
+            pending = []
+            if unknown:
+                txs = low_level.run_query(
+                    low_level.TX_TBL.get_all(*unknown), conn)
+                pending = low_level.tx_statuses_result(unknown, txs, statuses)
+            remaining = deadline - time.time()
+            if not pending or remaining <= 0:
+                return statuses
+            time.sleep(min(self.poll_interval, remaining))
+
+
+# Older transaction aborts younger owner, younger one waits for older owner
+class WoundWait(WaitPolicy):
+    def _decide(self, priority, owner_priority):
+        return WAIT if priority >= owner_priority else WOUND
+
+
+# Older transaction waits for younger owner, younger one gives up
+class WaitDie(WaitPolicy):
+    def _decide(self, priority, owner_priority):
+        return DIE if priority >= owner_priority else WAIT
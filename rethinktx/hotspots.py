@@ -0,0 +1,119 @@
+# Copyright 2016, Anton Frolov <frolov.anton@gmail.com>
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import threading
+import time
+
+import six
+
+
+# Space-saving sketch: keeps at most capacity counters, new item takes over
+# the smallest one and inherits its count as possible overestimation.
+# Items are grouped by count (stream-summary), so that both increment and
+# eviction take constant time.
+class SpaceSaving(object):
+    def __init__(self, capacity=1000):
+        self.capacity = capacity
+        self._counters = {}
+        self._buckets = {}
+        self._min = 0
+
+    def add(self, item):
+        counter = self._counters.get(item)
+        if counter is not None:
+            self._move(counter[0], item, item)
+            counter[0] += 1
+        elif len(self._counters) < self.capacity:
+            self._counters[item] = [1, 0]
+            self._buckets.setdefault(1, set()).add(item)
+            self._min = 1
+        else:
+            victim = next(iter(self._buckets[self._min]))
+            count = self._counters.pop(victim)[0]
+            self._counters[item] = [count + 1, count]
+            self._move(count, victim, item)
+
+    def _move(self, count, old, new):
+        bucket = self._buckets[count]
+        bucket.remove(old)
+        if not bucket:
+            del self._buckets[count]
+            # Moved item is the only one left with the least count
+            if count == self._min:
+                self._min = count + 1
+        self._buckets.setdefault(count + 1, set()).add(new)
+
+    def top(self, k):
+        items = sorted(six.iteritems(self._counters),
+                       key=lambda item: item[1][0], reverse=True)
+        return [(item, count, error) for item, (count, error) in items[:k]]
+
+    def __len__(self):
+        return len(self._counters)
+
+
+class HotspotTracker(object):
+    def __init__(self, capacity=1000):
+        self.capacity = capacity
+        self._lock = threading.Lock()
+        self.reset()
+
+    def conflict(self, table_name, key, kind):
+        with self._lock:
+            self._sketch.add((table_name, key))
+            self.kinds[kind] = self.kinds.get(kind, 0) + 1
+
+    def snapshot(self, k=10):
+        with self._lock:
+            elapsed = max(time.time() - self.started, 1e-9)
+            return [{'table': table_name,
+                     'key': key,
+                     'conflicts': count,
+                     'error': error,
+                     'rate': count / elapsed}
+                    for (table_name, key), count, error
+                    in self._sketch.top(k)]
+
+    def reset(self):
+        with self._lock:
+            self._sketch = SpaceSaving(self.capacity)
+            self.kinds = {}
+            self.started = time.time()
+
+
+_tracker = None
+
+
+def set_tracker(tracker):
+    global _tracker
+    _tracker = tracker
+
+
+def get_tracker():
+    return _tracker
+
+
+# Conflicts are attributed to tables by name, so callers that don't know it
+# are not tracked
+def conflict(table_name, key, kind):
+    tracker = _tracker
+    if tracker is not None and table_name is not None:
+        tracker.conflict(table_name, key, kind)
+
+
+def conflicts(table_name, keys, kind):
+    tracker = _tracker
+    if tracker is not None and table_name is not None:
+        for key in keys:
+            tracker.conflict(table_name, key, kind)
@@ -12,111 +12,549 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import itertools
+import time
 import uuid
 
 import rethinkdb
+import six
 
+from rethinktx import cache
 from rethinktx import exceptions
+from rethinktx import hotspots
+from rethinktx import metrics
 
-TX_TBL = rethinkdb.table('transactions')
+TX_TBL_NAME = 'transactions'
+TX_TBL = rethinkdb.table(TX_TBL_NAME)
+TIMESTAMP_INDEX = 'timestamp'
 INTENT_ROW = rethinkdb.row['intent']
 XID_ROW = rethinkdb.row['xid']
 STATUS_ROW = rethinkdb.row['status']
+WRITESET_TBL_NAME = 'transaction_writesets'
+WRITESET_TBL = rethinkdb.table(WRITESET_TBL_NAME)
+CLEAR_CHUNK_SIZE = 1000
+WRITE_CHUNK_SIZE = 200
+SCAN_BATCH_SIZE = 1000
 
+status_cache = cache.StatusCache()
 
-def run_query(query, conn):
-    return query.run(conn, read_mode='majority')
+
+def run_query(query, conn, read_mode='majority', noreply=False):
+    metrics.round_trip()
+    return query.run(conn, read_mode=read_mode, noreply=noreply)
+
+
+def chunks(items, size):
+    items = iter(items)
+    while True:
+        chunk = list(itertools.islice(items, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def unique(keys):
+    seen = set()
+    result = []
+    for key in keys:
+        if key not in seen:
+            seen.add(key)
+            result.append(key)
+    return result
+
+
+def create_tx_query(xid, priority=None):
+    # Priority orders transactions for contention policies, it's taken by
+    # client so that retries of the same transaction can keep it
+    if priority is None:
+        priority = time.time()
+    return TX_TBL.insert({'id': xid,
+                          'status': 'pending',
+                          'timestamp': rethinkdb.now(),
+                          'priority': priority},
+                         conflict='error', return_changes=True)
+
+
+def intent_update(row, xid, old_xid, document):
+    # Intent of committed transaction may still be in place if its write-back
+    # was deferred, so it has to become the value before being replaced.
+    # Documents are literals, otherwise update would merge nested objects
+    # with the ones being replaced.
+    document = rethinkdb.literal(document)
+    return rethinkdb.branch(
+        row['intent'].ne(None) & rethinkdb.expr(old_xid).ne(xid),
+        {'xid': xid, 'intent': document,
+         'value': rethinkdb.literal(row['intent'])},
+        {'xid': xid, 'intent': document})
+
+
+def write_query(xid, table, key, old_xid, document):
+    if old_xid is not None:
+        return table.get(key).update(
+            lambda row: rethinkdb.branch(
+                row['xid'].eq(old_xid),
+                intent_update(row, xid, old_xid, document),
+                rethinkdb.error('write conflict')))
+    else:
+        return table.insert({'id': key, 'xid': xid, 'intent': document},
+                            conflict='error')
+
+
+def delta_update(row, xid, old_xid, patch):
+    # Patch is applied to the latest version of document, which is intent if
+    # it's still in place. Patch fields replace the ones of document as is,
+    # same as dict.update does.
+    patch = {k: rethinkdb.literal(v) for k, v in six.iteritems(patch)}
+    document = rethinkdb.literal(rethinkdb.branch(
+        row['intent'].ne(None), row['intent'], row['value']).merge(patch))
+    return rethinkdb.branch(
+        row['intent'].ne(None) & rethinkdb.expr(old_xid).ne(xid),
+        {'xid': xid, 'intent': document,
+         'value': rethinkdb.literal(row['intent'])},
+        {'xid': xid, 'intent': document})
+
+
+def write_delta_query(xid, table, key, old_xid, patch):
+    return table.get(key).update(
+        lambda row: rethinkdb.branch(
+            row['xid'].eq(old_xid),
+            delta_update(row, xid, old_xid, patch),
+            rethinkdb.error('write conflict')))
+
+
+def write_batch_query(xid, table, keys, writes):
+    # Each write is a separate term of the array, so single query reports
+    # result of every one of them
+    return rethinkdb.expr([write_query(xid, table, key, writes[key][0],
+                                       writes[key][1])
+                           for key in keys])
+
+
+def resolve_intent_query(table, key, record_xid, committed):
+    update = {'intent': None}
+    if committed:
+        update['value'] = rethinkdb.literal(INTENT_ROW)
+    return table.get(key).update(
+        rethinkdb.branch(
+            XID_ROW.eq(record_xid) & INTENT_ROW.ne(None),
+            update, {}))
+
+
+def resolve_read_query(table, key, defer=False):
+    # Fetches the record together with its owner and resolves intent of
+    # finished transaction in the same query. Pending owner and missing
+    # transaction record are left for the client to deal with, as well as
+    # committed intent when its write-back is deferred.
+    return table.get(key).do(
+        lambda record: rethinkdb.branch(
+            record.eq(None) | record['intent'].eq(None),
+            {'record': record},
+            TX_TBL.get(record['xid']).do(
+                lambda tx: rethinkdb.branch(
+                    tx.eq(None),
+                    {'record': record},
+                    tx['status'].eq('pending'),
+                    {'record': record, 'tx': tx},
+                    tx['status'].eq('committed') & defer,
+                    {'xid': tx['id'], 'status': tx['status'],
+                     'record': record},
+                    {'xid': tx['id'],
+                     'status': tx['status'],
+                     'record': table.get(key).update(
+                         lambda row: rethinkdb.branch(
+                             row['xid'].eq(tx['id']) &
+                             row['intent'].ne(None),
+                             rethinkdb.branch(
+                                 tx['status'].eq('committed'),
+                                 {'intent': None,
+                                  'value': rethinkdb.literal(row['intent'])},
+                                 {'intent': None}),
+                             {}),
+                         return_changes='always')['changes'][0]['new_val']}
+                ))))
+
+
+def scan_query(table, index=None, lower=None, upper=None):
+    if index is None:
+        return table
+    return table.between(lower, upper, index=index)
+
+
+def in_range_query(index_fn, lower, upper, rows):
+    def in_range(row):
+        value = index_fn(row)
+        check = rethinkdb.expr(True)
+        if lower is not rethinkdb.minval:
+            check = check & value.ge(lower)
+        if upper is not rethinkdb.maxval:
+            check = check & value.lt(upper)
+        return check
+    return rethinkdb.expr(rows).filter(in_range).pluck('id')
+
+
+def resolve_intents_query(table, items):
+    return rethinkdb.expr(items).for_each(
+        lambda item: table.get(item[0]).update(
+            lambda row: rethinkdb.branch(
+                row['xid'].eq(item[1]) & row['intent'].ne(None),
+                rethinkdb.branch(item[2],
+                                 {'intent': None,
+                                  'value': rethinkdb.literal(row['intent'])},
+                                 {'intent': None}),
+                {})))
+
+
+def commit_query(xid, changes):
+    return TX_TBL.get(xid).update(
+        rethinkdb.branch(
+            STATUS_ROW.eq('pending'),
+            {'status': 'committed', 'changes': changes},
+            rethinkdb.error('precondition failed')))
+
+
+def writeset_id(xid, index):
+    return '%s:%d' % (xid, index)
+
+
+def writeset_ids(xid, writesets):
+    return [writeset_id(xid, index)
+            for index in six.moves.range(writesets)]
+
+
+def writeset_query(xid, index, table_name, keys):
+    # Number of write-sets is kept in transaction record, so they could be
+    # found whatever the transaction ends up with
+    return rethinkdb.expr([
+        WRITESET_TBL.insert({'id': writeset_id(xid, index),
+                             'xid': xid,
+                             'table': table_name,
+                             'keys': keys},
+                            conflict='replace'),
+        TX_TBL.get(xid).update({'writesets': index + 1})])
+
+
+def abort_query(xid):
+    return TX_TBL.get(xid).update(
+        rethinkdb.branch(
+            STATUS_ROW.eq('pending'),
+            {'status': 'aborted'},
+            {}),
+        return_changes='always')
+
+
+def abort_many_query(xids):
+    return TX_TBL.get_all(*xids).update(
+        rethinkdb.branch(
+            STATUS_ROW.eq('pending'),
+            {'status': 'aborted'},
+            {}),
+        return_changes='always')
+
+
+def aborts_feed_query():
+    return TX_TBL.changes().filter(
+        rethinkdb.row['new_val']['status'].eq('aborted'))
+
+
+def clear_query(xid, committed, table, keys):
+    update = {'intent': None}
+    if committed:
+        update['value'] = rethinkdb.literal(INTENT_ROW)
+    return table.get_all(*keys).update(
+        rethinkdb.branch(XID_ROW.eq(xid) & INTENT_ROW.ne(None),
+                         update, {}))
 
 
 def create_tx(conn):
+    return begin_tx(conn)[0]
+
+
+@metrics.timed('create_tx')
+def begin_tx(conn, priority=None):
     xid = str(uuid.uuid4())
-    result = run_query(TX_TBL.insert({'id': xid,
-                                      'status': 'pending',
-                                      'timestamp': rethinkdb.now()},
-                                     conflict='error'), conn)
+    return create_tx_result(xid, run_query(create_tx_query(xid, priority),
+                                           conn))
+
+
+def create_tx_result(xid, result):
     if result['inserted'] != 1:
         raise exceptions.DatabaseException(
             'Error creating transaction record: %s', result.get('error'))
-    return xid
+    return xid, result['changes'][0]['new_val']['timestamp']
 
 
-def write(conn, xid, table, key, old_xid, document):
-    if old_xid is not None:
-        result = run_query(table.get(key).update(
-                               rethinkdb.branch(
-                                   XID_ROW.eq(old_xid),
-                                   {'xid': xid, 'intent': document},
-                                   rethinkdb.error('write conflict'))),
-                           conn)
-    else:
-        result = run_query(table.insert({'id': key, 'xid': xid,
-                                         'intent': document},
-                                        conflict='error'),
-                           conn)
+@metrics.timed('write')
+def write(conn, xid, table, key, old_xid, document, table_name=None):
+    write_result(xid, table_name, key, run_query(
+        write_query(xid, table, key, old_xid, document), conn))
+
+
+@metrics.timed('write')
+def write_delta(conn, xid, table, key, old_xid, patch, table_name=None):
+    write_result(xid, table_name, key, run_query(
+        write_delta_query(xid, table, key, old_xid, patch), conn))
+
+
+def write_result(xid, table_name, key, result):
     if result['errors'] != 0:
+        metrics.lock_failure('write')
+        hotspots.conflict(table_name, key, 'write')
         raise exceptions.OptimisticLockFailure(xid)
 
 
-def read(conn, table, key, default=None):
-    record = run_query(table.get(key), conn)
-    if record is None:
-        return None, default
-    while record['intent'] is not None:
+@metrics.timed('write')
+def write_many(conn, xid, table, writes, table_name=None):
+    failed = []
+    for keys in chunks(writes, WRITE_CHUNK_SIZE):
+        results = run_query(write_batch_query(xid, table, keys, writes), conn)
+        failed.extend(key for key, result in zip(keys, results)
+                      if result['errors'] != 0)
+    if failed:
+        metrics.lock_failure('write')
+        hotspots.conflicts(table_name, failed, 'write')
+        raise exceptions.OptimisticLockFailure(xid, failed)
+
+
+@metrics.timed('read')
+def read(conn, table, key, default=None, read_mode='majority',
+         resolve_pending=None, write_back=None, own_xid=None,
+         table_name=None):
+    while True:
+        result = run_query(
+            resolve_read_query(table, key, write_back is not None),
+            conn, read_mode)
+        if 'tx' in result:
+            if result['tx']['id'] == own_xid:
+                return own_xid, result['record']['intent']
+            metrics.intents('pending')
+            hotspots.conflict(table_name, key, 'intent')
+            (resolve_pending or abort_pending)(conn, [result['tx']])
+            continue
+        record = read_result(result)
+        if record is None:
+            return None, default
+        if record['intent'] is None:
+            if 'status' in result:
+                metrics.intents(result['status'])
+            return record['xid'], record.get('value', default)
         record_xid = record['xid']
-        tx = run_query(TX_TBL.get(record_xid), conn)
-        if tx is None:
-            tx_status = 'aborted'
+        # Transaction record may be gone, then only cached status may tell
+        # that it was committed
+        committed = result.get('status',
+                               status_cache.get(record_xid)) == 'committed'
+        if committed and write_back is not None:
+            try:
+                write_back(key, record_xid)
+                metrics.intents('deferred')
+                return record_xid, record['intent']
+            except RuntimeError:
+                # Resolver is shut down, so intent is moved right away
+                pass
+        run_query(resolve_intent_query(table, key, record_xid, committed),
+                  conn)
+        metrics.intents('committed' if committed else 'aborted')
+
+
+def read_result(result):
+    if 'status' in result:
+        status_cache.put(result['xid'], result['status'])
+    return result['record']
+
+
+@metrics.timed('read')
+def read_many(conn, table, keys, default=None, read_mode='majority',
+              resolve_pending=None, own_xid=None, table_name=None):
+    keys = unique(keys)
+    results = {}
+    if keys:
+        records = run_query(table.get_all(*keys), conn, read_mode)
+        resolve_records(conn, table, keys, records, results, default,
+                        read_mode, resolve_pending, own_xid, table_name)
+    return results
+
+
+def scan(conn, table, query, default=None, read_mode='majority',
+         resolve_pending=None, own_xid=None, batch_size=SCAN_BATCH_SIZE,
+         table_name=None):
+    cursor = run_query(query, conn, read_mode)
+    try:
+        for batch in chunks(cursor, batch_size):
+            keys = [record['id'] for record in batch]
+            results = {}
+            resolve_records(conn, table, keys, batch, results, default,
+                            read_mode, resolve_pending, own_xid, table_name)
+            # Documents of records having intents may differ from values
+            # matched by the query
+            unsettled = set(record['id'] for record in batch
+                            if record['intent'] is not None)
+            yield [(key, results[key]) for key in keys], unsettled
+    finally:
+        # Abandoned scan must not keep the cursor open on the server
+        if isinstance(cursor, rethinkdb.net.Cursor):
+            cursor.close()
+
+
+def in_range(conn, index_fn, lower, upper, rows):
+    return set(row['id'] for row in run_query(
+        in_range_query(index_fn, lower, upper, rows), conn))
+
+
+def resolve_records(conn, table, keys, records, results, default,
+                    read_mode='majority', resolve_pending=None,
+                    own_xid=None, table_name=None):
+    while True:
+        dirty = collect_records(keys, records, results, default, own_xid)
+        if not dirty:
+            return
+        statuses = tx_statuses(conn, set(six.itervalues(dirty)), read_mode,
+                               contended(table_name, dirty, resolve_pending))
+        items = [[key, record_xid, statuses[record_xid] == 'committed']
+                 for key, record_xid in six.iteritems(dirty)]
+        run_query(resolve_intents_query(table, items), conn)
+        committed = sum(1 for item in items if item[2])
+        metrics.intents('committed', committed)
+        metrics.intents('aborted', len(items) - committed)
+        keys = list(dirty)
+        records = run_query(table.get_all(*keys), conn, read_mode)
+
+
+def contended(table_name, dirty, resolve_pending):
+    def resolve(conn, owners):
+        xids = set(owner['id'] for owner in owners)
+        hotspots.conflicts(table_name,
+                           [key for key, record_xid in six.iteritems(dirty)
+                            if record_xid in xids], 'intent')
+        return (resolve_pending or abort_pending)(conn, owners)
+    return resolve
+
+
+def collect_records(keys, records, results, default, own_xid=None):
+    records = {record['id']: record for record in records}
+    dirty = {}
+    for key in keys:
+        record = records.get(key)
+        if record is None:
+            results[key] = None, default
+        elif record['intent'] is None:
+            results[key] = record['xid'], record.get('value', default)
+        elif record['xid'] == own_xid:
+            results[key] = own_xid, record['intent']
+        else:
+            dirty[key] = record['xid']
+    return dirty
+
+
+def tx_status_result(xid, tx):
+    if tx is None:
+        return 'aborted'
+    status_cache.put(xid, tx['status'])
+    return tx['status']
+
+
+def cached_statuses(xids):
+    statuses = {}
+    unknown = []
+    for xid in xids:
+        status = status_cache.get(xid)
+        if status is None:
+            unknown.append(xid)
         else:
-            tx_status = tx['status']
-        if tx_status == 'pending':
-            if abort(conn, record_xid):
-                tx_status = 'aborted'
-            else:
-                continue
-        if tx_status == 'aborted':
-            result = run_query(table.get(key).update(
-                rethinkdb.branch(
-                    XID_ROW.eq(record_xid) & INTENT_ROW.ne(None),
-                    {'intent': None}, {}),
-                return_changes='always'), conn)
-            record = result['changes'][0]['new_val']
-        elif tx['status'] == 'committed':
-            result = run_query(table.get(key).update(
-                rethinkdb.branch(
-                    XID_ROW.eq(record_xid) & INTENT_ROW.ne(None),
-                    {'intent': None, 'value': INTENT_ROW}, {}),
-                return_changes='always'), conn)
-            record = result['changes'][0]['new_val']
-    return record['xid'], record.get('value', default)
+            statuses[xid] = status
+    return statuses, unknown
+
 
+def tx_statuses_result(xids, txs, statuses):
+    statuses.update(dict.fromkeys(xids, 'aborted'))
+    pending = []
+    for tx in txs:
+        statuses[tx['id']] = tx_status_result(tx['id'], tx)
+        if tx['status'] == 'pending':
+            pending.append(tx)
+    return pending
 
+
+def tx_statuses(conn, xids, read_mode='majority', resolve_pending=None):
+    statuses, unknown = cached_statuses(xids)
+    if unknown:
+        pending = tx_statuses_result(
+            unknown, run_query(TX_TBL.get_all(*unknown), conn, read_mode),
+            statuses)
+        if pending:
+            metrics.intents('pending', len(pending))
+            statuses.update((resolve_pending or abort_pending)(conn, pending))
+    return statuses
+
+
+def abort_pending(conn, txs):
+    if len(txs) == 1:
+        xid = txs[0]['id']
+        return {xid: 'aborted' if abort(conn, xid) else 'committed'}
+    return abort_many(conn, [tx['id'] for tx in txs])
+
+
+@metrics.timed('commit')
 def commit(conn, xid, changes):
-    result = run_query(TX_TBL.get(xid).update(
-        rethinkdb.branch(
-            STATUS_ROW.eq('pending'),
-            {'status': 'committed', 'changes': changes},
-            rethinkdb.error('precondition failed'))), conn)
-    return result['errors'] == 0
+    return commit_result(xid, run_query(commit_query(xid, changes), conn))
 
 
+def commit_result(xid, result):
+    if result['errors'] == 0:
+        status_cache.put(xid, 'committed')
+        return True
+    metrics.lock_failure('commit')
+    return False
+
+
+@metrics.timed('abort')
 def abort(conn, xid):
-    result = run_query(TX_TBL.get(xid).update(
-        rethinkdb.branch(
-            STATUS_ROW.eq('pending'),
-            {'status': 'aborted'},
-            {}),
-        return_changes='always'), conn)
+    return abort_result(xid, run_query(abort_query(xid), conn))
+
+
+def abort_result(xid, result):
     if result['skipped'] == 1:
-        return True
+        aborted = True
     else:
-        return result['changes'][0]['new_val']['status'] == 'aborted'
+        aborted = result['changes'][0]['new_val']['status'] == 'aborted'
+    # Transaction that can't be aborted is already committed
+    status_cache.put(xid, 'aborted' if aborted else 'committed')
+    return aborted
 
 
-def clear(conn, xid, committed, table, keys):
-    update = {'intent': None}
-    if committed:
-        update['value'] = INTENT_ROW
-    for key in keys:
-        run_query(table.get(key).update(
-            rethinkdb.branch(XID_ROW.eq(xid) & INTENT_ROW.ne(None),
-                             update, {})), conn)
+@metrics.timed('abort')
+def abort_many(conn, xids):
+    return abort_many_result(xids, run_query(abort_many_query(xids), conn))
+
+
+def abort_many_result(xids, result):
+    statuses = dict.fromkeys(xids, 'aborted')
+    for change in result.get('changes', ()):
+        new_val = change['new_val']
+        if new_val is not None:
+            statuses[new_val['id']] = new_val['status']
+    for xid, status in six.iteritems(statuses):
+        status_cache.put(xid, status)
+    return statuses
+
+
+@metrics.timed('clear')
+def clear(conn, xid, committed, table, keys, noreply=False):
+    for chunk in chunks(keys, CLEAR_CHUNK_SIZE):
+        run_query(clear_query(xid, committed, table, chunk), conn,
+                  noreply=noreply)
+
+
+def write_writeset(conn, xid, index, table_name, keys):
+    run_query(writeset_query(xid, index, table_name, keys), conn)
+
+
+# Keys written in bulk are kept in write-set records rather than in the
+# transaction record itself
+def clear_writesets(conn, xid, committed, writesets, noreply=False):
+    for ids in chunks(writeset_ids(xid, writesets), CLEAR_CHUNK_SIZE):
+        for writeset in run_query(WRITESET_TBL.get_all(*ids), conn):
+            clear(conn, xid, committed, rethinkdb.table(writeset['table']),
+                  writeset['keys'], noreply)
+
+
+def barrier(conn):
+    conn.noreply_wait()
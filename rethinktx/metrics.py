@@ -0,0 +1,181 @@
+# Copyright 2016, Anton Frolov <frolov.anton@gmail.com>
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import bisect
+import collections
+import functools
+import threading
+import time
+
+import six
+
+LATENCY_BOUNDS = tuple(0.0001 * 2 ** i for i in six.moves.range(18))
+COUNT_BOUNDS = tuple(2 ** i for i in six.moves.range(16))
+
+
+class Observer(object):
+    def operation(self, name, latency):
+        pass
+
+    def intents(self, kind, count):
+        pass
+
+    def lock_failure(self, operation):
+        pass
+
+    def transaction(self, state, duration, round_trips):
+        pass
+
+
+class Histogram(object):
+    def __init__(self, bounds=LATENCY_BOUNDS):
+        self.bounds = bounds
+        self.buckets = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0
+        self.maximum = 0
+
+    def add(self, value):
+        self.buckets[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        self.maximum = max(self.maximum, value)
+
+    def percentile(self, q):
+        if not self.count:
+            return 0
+        # Upper bound of the bucket holding requested rank
+        rank = q / 100.0 * self.count
+        seen = 0
+        for bound, count in zip(self.bounds, self.buckets):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.maximum)
+        return self.maximum
+
+    def snapshot(self):
+        return {
+            'count': self.count,
+            'total': self.total,
+            'max': self.maximum,
+            'p50': self.percentile(50),
+            'p95': self.percentile(95),
+            'p99': self.percentile(99),
+        }
+
+
+class HistogramCollector(Observer):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def operation(self, name, latency):
+        with self._lock:
+            histogram = self._operations.get(name)
+            if histogram is None:
+                histogram = self._operations[name] = Histogram()
+            histogram.add(latency)
+
+    def intents(self, kind, count):
+        with self._lock:
+            self._intents[kind] += count
+
+    def lock_failure(self, operation):
+        with self._lock:
+            self._lock_failures[operation] += 1
+
+    def transaction(self, state, duration, round_trips):
+        with self._lock:
+            histogram = self._transactions.get(state)
+            if histogram is None:
+                histogram = self._transactions[state] = Histogram()
+            histogram.add(duration)
+            self._round_trips.add(round_trips)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'operations': {name: histogram.snapshot()
+                               for name, histogram
+                               in six.iteritems(self._operations)},
+                'transactions': {state: histogram.snapshot()
+                                 for state, histogram
+                                 in six.iteritems(self._transactions)},
+                'round_trips': self._round_trips.snapshot(),
+                'intents': dict(self._intents),
+                'lock_failures': dict(self._lock_failures),
+            }
+
+    def reset(self):
+        with self._lock:
+            self._operations = {}
+            self._transactions = {}
+            self._round_trips = Histogram(COUNT_BOUNDS)
+            self._intents = collections.Counter()
+            self._lock_failures = collections.Counter()
+
+
+NULL = Observer()
+_observer = NULL
+_local = threading.local()
+
+
+def set_observer(observer):
+    global _observer
+    _observer = NULL if observer is None else observer
+
+
+def get_observer():
+    return _observer
+
+
+def timed(operation):
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            observer = _observer
+            # Default observer doesn't even get the clock read
+            if observer is NULL:
+                return fn(*args, **kwargs)
+            started = time.time()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                observer.operation(operation, time.time() - started)
+        return wrapper
+    return decorator
+
+
+def round_trip():
+    if _observer is not NULL:
+        _local.round_trips = round_trips() + 1
+
+
+# Round trips are counted per thread, so transactions interleaved within
+# single thread are charged for each other's queries
+def round_trips():
+    return getattr(_local, 'round_trips', 0)
+
+
+def intents(kind, count=1):
+    if count:
+        _observer.intents(kind, count)
+
+
+def lock_failure(operation):
+    _observer.lock_failure(operation)
+
+
+def transaction(state, duration, round_trips):
+    _observer.transaction(state, duration, round_trips)
@@ -0,0 +1,132 @@
+# Copyright 2016, Anton Frolov <frolov.anton@gmail.com>
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import contextlib
+import functools
+import logging
+import threading
+import time
+
+import rethinkdb
+import six
+
+from rethinktx import exceptions
+
+LOG = logging.getLogger(__name__)
+
+
+class ConnectionPool(object):
+    def __init__(self, size=10, connect=None, timeout=None, probe_idle=30.0,
+                 **connect_kwargs):
+        if connect is None:
+            connect = functools.partial(rethinkdb.connect, **connect_kwargs)
+        self._connect = connect
+        self._timeout = timeout
+        self._probe_idle = probe_idle
+        self._lock = threading.Lock()
+        self._closed = False
+        # Free slots are represented by None, idle connections are pushed on
+        # top of them so that most recently used connections are reused first.
+        # Idle connections are kept together with time they were released.
+        self._slots = six.moves.queue.LifoQueue()
+        for _ in six.moves.range(size):
+            self._slots.put(None)
+
+    def acquire(self, timeout=None):
+        with self._lock:
+            if self._closed:
+                raise RuntimeError('Connection pool is closed')
+        if timeout is None:
+            timeout = self._timeout
+        try:
+            idle = self._slots.get(timeout=timeout)
+        except six.moves.queue.Empty:
+            raise exceptions.DatabaseException(
+                'Timed out waiting for connection from pool')
+        try:
+            return self._ensure_open(idle)
+        except Exception:
+            self._slots.put(None)
+            raise
+
+    def release(self, conn, broken=False):
+        if broken or self._closed:
+            self._close(conn)
+            self._slots.put(None)
+        else:
+            self._slots.put((conn, time.time()))
+
+    @contextlib.contextmanager
+    def connection(self, timeout=None):
+        conn = self.acquire(timeout)
+        try:
+            yield conn
+        except rethinkdb.ReqlDriverError:
+            self.release(conn, broken=True)
+            raise
+        except Exception:
+            self.release(conn)
+            raise
+        else:
+            self.release(conn)
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+        while True:
+            try:
+                idle = self._slots.get_nowait()
+            except six.moves.queue.Empty:
+                break
+            if idle is None:
+                continue
+            self._close(idle[0])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _ensure_open(self, idle):
+        if idle is not None:
+            conn, released = idle
+            if conn.is_open() and self._alive(conn, released):
+                return conn
+            try:
+                return conn.reconnect(noreply_wait=False)
+            except rethinkdb.ReqlDriverError:
+                LOG.debug('Failed to reopen pooled connection', exc_info=True)
+                self._close(conn)
+        return self._connect()
+
+    def _alive(self, conn, released):
+        # is_open() only reflects local state, so connection dropped by
+        # server is detected by cheap query once it has been idle for a while
+        if (self._probe_idle is None or
+                time.time() - released < self._probe_idle):
+            return True
+        try:
+            rethinkdb.expr(1).run(conn)
+            return True
+        except rethinkdb.ReqlDriverError:
+            LOG.debug('Pooled connection is dead', exc_info=True)
+            return False
+
+    @staticmethod
+    def _close(conn):
+        try:
+            conn.close(noreply_wait=False)
+        except rethinkdb.ReqlDriverError:
+            LOG.debug('Failed to close connection', exc_info=True)
@@ -0,0 +1,173 @@
+# Copyright 2016, Anton Frolov <frolov.anton@gmail.com>
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import argparse
+import logging
+import threading
+
+import rethinkdb
+
+from rethinktx import low_level
+
+LOG = logging.getLogger(__name__)
+INTENT_INDEX = 'intent_xid'
+DEFAULT_TIMEOUT = 60
+DEFAULT_BATCH_SIZE = 100
+
+
+def intent_index(row):
+    # Documents for which index function fails are not indexed, so only
+    # records having intent end up in the index
+    return rethinkdb.branch(row['intent'].ne(None), [row['xid'], row['id']],
+                            rethinkdb.error('no intent'))
+
+
+def provision(conn, tables):
+    table_names = [low_level.TX_TBL_NAME,
+                   low_level.WRITESET_TBL_NAME] + list(tables)
+    existing = low_level.run_query(rethinkdb.table_list(), conn)
+    for table_name in table_names:
+        if table_name not in existing:
+            low_level.run_query(rethinkdb.table_create(table_name), conn)
+    if low_level.TIMESTAMP_INDEX not in low_level.run_query(
+            low_level.TX_TBL.index_list(), conn):
+        low_level.run_query(low_level.TX_TBL.index_create(
+            low_level.TIMESTAMP_INDEX, rethinkdb.row['timestamp']), conn)
+    low_level.run_query(low_level.TX_TBL.index_wait(low_level.TIMESTAMP_INDEX),
+                        conn)
+    for table_name in tables:
+        table = rethinkdb.table(table_name)
+        if INTENT_INDEX not in low_level.run_query(table.index_list(), conn):
+            low_level.run_query(table.index_create(INTENT_INDEX, intent_index),
+                                conn)
+        low_level.run_query(table.index_wait(INTENT_INDEX), conn)
+
+
+def abort_stale_query(xids, timeout):
+    return low_level.TX_TBL.get_all(*xids).update(
+        lambda tx: rethinkdb.branch(
+            tx['status'].eq('pending') &
+            tx['timestamp'].lt(rethinkdb.now() - timeout),
+            {'status': 'aborted'},
+            {}),
+        return_changes='always')
+
+
+def intents_query(table, lower, batch_size):
+    return table.between(lower, rethinkdb.maxval, index=INTENT_INDEX,
+                         left_bound='open') \
+        .order_by(index=INTENT_INDEX).limit(batch_size).pluck('id', 'xid')
+
+
+def recover(conn, table, timeout=DEFAULT_TIMEOUT,
+            batch_size=DEFAULT_BATCH_SIZE):
+    resolved = 0
+    lower = rethinkdb.minval
+    while True:
+        records = list(low_level.run_query(
+            intents_query(table, lower, batch_size), conn))
+        if records:
+            resolved += resolve_batch(conn, table, records, timeout)
+        if len(records) < batch_size:
+            return resolved
+        # Intents of transactions that are still running stay in index, so
+        # continue after the last seen one instead of starting over
+        lower = [records[-1]['xid'], records[-1]['id']]
+
+
+def resolve_batch(conn, table, records, timeout):
+    xids = set(record['xid'] for record in records)
+    statuses, unknown = low_level.cached_statuses(xids)
+    if unknown:
+        # Transactions that are pending for too long are considered to be
+        # abandoned by crashed clients
+        statuses.update(low_level.abort_many_result(
+            unknown, low_level.run_query(
+                abort_stale_query(unknown, timeout), conn)))
+
+    items = [[record['id'], record['xid'],
+              statuses[record['xid']] == 'committed']
+             for record in records
+             if statuses[record['xid']] != 'pending']
+    if items:
+        low_level.run_query(low_level.resolve_intents_query(table, items),
+                            conn)
+    return len(items)
+
+
+class RecoveryDaemon(object):
+    def __init__(self, conn, tables, timeout=DEFAULT_TIMEOUT,
+                 batch_size=DEFAULT_BATCH_SIZE, interval=5.0):
+        self.conn = conn
+        self.tables = [rethinkdb.table(name) for name in tables]
+        self.timeout = timeout
+        self.batch_size = batch_size
+        self.interval = interval
+        self.resolved = 0
+        self._stop = threading.Event()
+
+    def run_once(self):
+        resolved = 0
+        for table in self.tables:
+            resolved += recover(self.conn, table, self.timeout,
+                                self.batch_size)
+        self.resolved += resolved
+        return resolved
+
+    def run(self):
+        while not self._stop.is_set():
+            self.run_once()
+            self._stop.wait(self.interval)
+
+    def stop(self):
+        self._stop.set()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Resolve intents left by crashed clients.')
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=rethinkdb.DEFAULT_PORT)
+    parser.add_argument('--db', default=None)
+    parser.add_argument('--table', dest='tables', action='append',
+                        required=True, help='table to scan for intents')
+    parser.add_argument('--timeout', type=float, default=DEFAULT_TIMEOUT,
+                        help='seconds after which pending transaction is '
+                             'considered abandoned')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument('--interval', type=float, default=5.0,
+                        help='seconds to sleep between scans')
+    parser.add_argument('--provision', action='store_true',
+                        help='create required tables and indexes and exit')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    conn = rethinkdb.connect(args.host, args.port, db=args.db)
+    try:
+        if args.provision:
+            provision(conn, args.tables)
+            return
+        daemon = RecoveryDaemon(conn, args.tables, args.timeout,
+                                args.batch_size, args.interval)
+        try:
+            daemon.run()
+        except KeyboardInterrupt:
+            pass
+        LOG.info('Resolved %d intents', daemon.resolved)
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
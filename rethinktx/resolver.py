@@ -0,0 +1,125 @@
+# Copyright 2016, Anton Frolov <frolov.anton@gmail.com>
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import logging
+import threading
+
+import rethinkdb
+import six
+
+from rethinktx import low_level
+
+LOG = logging.getLogger(__name__)
+_STOP = object()
+
+
+class IntentResolver(object):
+    def __init__(self, connect, num_workers=2, max_pending=1000):
+        self._connect = connect
+        self._queue = six.moves.queue.Queue(max_pending)
+        self._lock = threading.Lock()
+        self._stopped = False
+        self._deferred = {}
+        self._workers = []
+        for _ in six.moves.range(num_workers):
+            worker = threading.Thread(target=self._run)
+            worker.daemon = True
+            worker.start()
+            self._workers.append(worker)
+
+    def submit(self, xid, committed, writes_keys, writesets=0):
+        with self._lock:
+            if self._stopped:
+                raise RuntimeError('Resolver is shut down')
+        self._queue.put((xid, committed, writes_keys, writesets))
+
+    def defer(self, table_name, key, xid):
+        with self._lock:
+            if self._stopped:
+                raise RuntimeError('Resolver is shut down')
+            # Keys deferred while previous ones are still queued are picked
+            # up by the same task
+            tables = self._deferred.get(xid)
+            if tables is not None:
+                tables.setdefault(table_name, set()).add(key)
+                return
+            self._deferred[xid] = {table_name: set([key])}
+        self._queue.put((xid, True, None, 0))
+
+    def flush(self):
+        self._queue.join()
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            if self._stopped:
+                return
+            self._stopped = True
+        for _ in self._workers:
+            self._queue.put(_STOP)
+        if wait:
+            for worker in self._workers:
+                worker.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.shutdown()
+
+    def _run(self):
+        conn = None
+        try:
+            while True:
+                task = self._queue.get()
+                try:
+                    if task is _STOP:
+                        return
+                    xid, committed, writes_keys, writesets = task
+                    if writes_keys is None:
+                        with self._lock:
+                            writes_keys = self._deferred.pop(xid)
+                    if conn is None:
+                        conn = self._connect()
+                    self._resolve(conn, xid, committed, writes_keys,
+                                  writesets)
+                except rethinkdb.ReqlDriverError:
+                    # Intents of the task are left for readers to resolve,
+                    # connection is reopened for the next one
+                    LOG.exception('Failed to clear intents of transaction '
+                                  '#%s', task[0])
+                    conn = self._close(conn)
+                except Exception:
+                    LOG.exception('Failed to clear intents of transaction '
+                                  '#%s', task[0])
+                finally:
+                    self._queue.task_done()
+        finally:
+            self._close(conn)
+
+    @staticmethod
+    def _close(conn):
+        if conn is not None:
+            try:
+                conn.close(noreply_wait=False)
+            except rethinkdb.ReqlDriverError:
+                pass
+        return None
+
+    @staticmethod
+    def _resolve(conn, xid, committed, writes_keys, writesets):
+        for table_name, keys in six.iteritems(writes_keys):
+            table = rethinkdb.table(table_name)
+            low_level.clear(conn, xid, committed, table, keys)
+        if writesets:
+            low_level.clear_writesets(conn, xid, committed, writesets)
@@ -0,0 +1,130 @@
+# Copyright 2016, Anton Frolov <frolov.anton@gmail.com>
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import functools
+import logging
+import random
+import threading
+import time
+
+from rethinktx import exceptions
+from rethinktx import pool
+from rethinktx import transaction
+
+LOG = logging.getLogger(__name__)
+
+
+class ExponentialBackoff(object):
+    def __init__(self, initial=0.005, maximum=1.0, multiplier=2.0,
+                 jitter=True):
+        self.initial = initial
+        self.maximum = maximum
+        self.multiplier = multiplier
+        self.jitter = jitter
+
+    def delay(self, attempt):
+        delay = min(self.maximum,
+                    self.initial * self.multiplier ** (attempt - 1))
+        if self.jitter:
+            # "Full jitter" spreads retries of transactions that conflicted
+            # with each other so they don't collide again
+            delay = random.uniform(0, delay)
+        return delay
+
+
+class RetryStats(object):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.attempts = 0
+        self.commits = 0
+        self.aborts = 0
+        self.failures = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+
+    def record(self, committed, latency):
+        with self._lock:
+            self.attempts += 1
+            if committed:
+                self.commits += 1
+            else:
+                self.aborts += 1
+            self.latency_total += latency
+            self.latency_max = max(self.latency_max, latency)
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'attempts': self.attempts,
+                'commits': self.commits,
+                'aborts': self.aborts,
+                'failures': self.failures,
+                'latency_total': self.latency_total,
+                'latency_max': self.latency_max,
+            }
+
+    def reset(self):
+        with self._lock:
+            self.attempts = self.commits = self.aborts = self.failures = 0
+            self.latency_total = self.latency_max = 0.0
+
+
+stats = RetryStats()
+
+
+def run_in_transaction(fn, conn_or_pool=None, max_attempts=5, backoff=None,
+                       retry_stats=None, **tx_kwargs):
+    if backoff is None:
+        backoff = ExponentialBackoff()
+    if retry_stats is None:
+        retry_stats = stats
+    if isinstance(conn_or_pool, pool.ConnectionPool):
+        tx_kwargs['pool'] = conn_or_pool
+    else:
+        tx_kwargs['conn'] = conn_or_pool
+
+    tx_kwargs.setdefault('priority', time.time())
+    attempt = 0
+    while True:
+        attempt += 1
+        started = time.time()
+        try:
+            with transaction.Transaction(**tx_kwargs) as tx:
+                result = fn(tx)
+        except exceptions.OptimisticLockFailure:
+            retry_stats.record(False, time.time() - started)
+            if attempt >= max_attempts:
+                retry_stats.record_failure()
+                raise
+            delay = backoff.delay(attempt)
+            LOG.debug('Transaction attempt %d failed, retrying in %.3fs',
+                      attempt, delay)
+            time.sleep(delay)
+        else:
+            retry_stats.record(True, time.time() - started)
+            return result
+
+
+def transactional(conn_or_pool=None, **kwargs):
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **fn_kwargs):
+            return run_in_transaction(
+                lambda tx: fn(tx, *args, **fn_kwargs), conn_or_pool, **kwargs)
+        return wrapper
+    return decorator
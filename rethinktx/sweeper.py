@@ -0,0 +1,143 @@
+# Copyright 2016, Anton Frolov <frolov.anton@gmail.com>
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import argparse
+import logging
+import threading
+import time
+
+import rethinkdb
+import six
+
+from rethinktx import low_level
+from rethinktx import recovery
+
+LOG = logging.getLogger(__name__)
+DEFAULT_RETENTION = 3600
+DEFAULT_BATCH_SIZE = 100
+
+
+def finished_query(retention, batch_size):
+    # Only records older than retention are scanned, oldest first
+    return low_level.TX_TBL.between(
+        rethinkdb.minval, rethinkdb.now() - retention,
+        index=low_level.TIMESTAMP_INDEX
+    ).order_by(index=low_level.TIMESTAMP_INDEX).filter(
+        lambda tx: tx['status'].ne('pending')
+    ).limit(batch_size)
+
+
+def sweep(conn, retention=DEFAULT_RETENTION, batch_size=DEFAULT_BATCH_SIZE):
+    records = list(low_level.run_query(
+        finished_query(retention, batch_size), conn))
+    for record in records:
+        # Missing transaction record is treated as aborted by read procedure,
+        # so intents of committed transaction must be moved to value before
+        # its record could be deleted. Aborted records can go right away.
+        if record['status'] != 'committed':
+            continue
+        for table_name, keys in six.iteritems(record.get('changes') or {}):
+            low_level.clear(conn, record['id'], True,
+                            rethinkdb.table(table_name), keys)
+        low_level.clear_writesets(conn, record['id'], True,
+                                  record.get('writesets', 0))
+    writeset_ids = []
+    for record in records:
+        writeset_ids.extend(low_level.writeset_ids(
+            record['id'], record.get('writesets', 0)))
+    for ids in low_level.chunks(writeset_ids, low_level.CLEAR_CHUNK_SIZE):
+        low_level.run_query(low_level.WRITESET_TBL.get_all(*ids).delete(),
+                            conn)
+    if records:
+        low_level.run_query(low_level.TX_TBL.get_all(
+            *[record['id'] for record in records]).delete(), conn)
+    LOG.debug('Deleted %d finished transaction records', len(records))
+    return len(records)
+
+
+class Sweeper(object):
+    def __init__(self, conn, retention=DEFAULT_RETENTION,
+                 batch_size=DEFAULT_BATCH_SIZE, max_rate=None, interval=10.0):
+        self.conn = conn
+        self.retention = retention
+        self.batch_size = batch_size
+        self.max_rate = max_rate
+        self.interval = interval
+        self.deleted = 0
+        self._stop = threading.Event()
+
+    def run_once(self):
+        started = time.time()
+        deleted = sweep(self.conn, self.retention, self.batch_size)
+        self.deleted += deleted
+        delay = 0
+        if self.max_rate:
+            delay = deleted / float(self.max_rate) - (time.time() - started)
+        if deleted < self.batch_size:
+            delay = max(delay, self.interval)
+        return deleted, delay
+
+    def run(self):
+        while not self._stop.is_set():
+            _, delay = self.run_once()
+            if delay > 0:
+                self._stop.wait(delay)
+
+    def stop(self):
+        self._stop.set()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Delete finished transaction records.')
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=rethinkdb.DEFAULT_PORT)
+    parser.add_argument('--db', default=None)
+    parser.add_argument('--retention', type=float, default=DEFAULT_RETENTION,
+                        help='seconds to keep finished transaction records')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument('--max-rate', type=float, default=None,
+                        help='maximum number of records deleted per second')
+    parser.add_argument('--interval', type=float, default=10.0,
+                        help='seconds to sleep when nothing is left to delete')
+    parser.add_argument('--once', action='store_true',
+                        help='delete single batch and exit')
+    parser.add_argument('--provision', action='store_true',
+                        help='create required tables and indexes and exit')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    conn = rethinkdb.connect(args.host, args.port, db=args.db)
+    if args.provision:
+        try:
+            recovery.provision(conn, [])
+        finally:
+            conn.close()
+        return
+    sweeper = Sweeper(conn, args.retention, args.batch_size, args.max_rate,
+                      args.interval)
+    try:
+        if args.once:
+            sweeper.run_once()
+        else:
+            sweeper.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        LOG.info('Deleted %d finished transaction records', sweeper.deleted)
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -12,13 +12,19 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import contextlib
+import functools
 import logging
 import six
+import time
 
 import rethinkdb
 
+from rethinktx import codec
 from rethinktx import exceptions
+from rethinktx import hotspots
 from rethinktx import low_level
+from rethinktx import metrics
 
 LOG = logging.getLogger(__name__)
 MISSING = object()
@@ -39,38 +45,163 @@ class VersionedDocument(object):
             name=self.__class__.__name__, xid=self.xid, doc=self.doc)
 
 
+class PatchedDocument(VersionedDocument):
+    __slots__ = ('base', 'patches')
+
+    def __init__(self, xid, base, patches):
+        self.xid = xid
+        self.base = base
+        self.patches = patches
+
+    @classmethod
+    def patch(cls, xid, vd, patch):
+        if isinstance(vd, PatchedDocument):
+            return cls(xid, vd.base, vd.patches + (dict(patch),))
+        return cls(xid, vd.doc, (dict(patch),))
+
+    @property
+    def doc(self):
+        # Patches are applied on first access only
+        if self.patches:
+            doc = dict(self.base)
+            for patch in self.patches:
+                doc.update(patch)
+            self.base, self.patches = doc, ()
+        return self.base
+
+    @doc.setter
+    def doc(self, doc):
+        self.base, self.patches = doc, ()
+
+
 class Table(object):
     def __init__(self, tx, name):
         self.tx = tx
         self.name = name
         self.table = rethinkdb.table(name)
+        self.codec = tx._codec(name)
 
-    def _read(self, key, default=None):
+    def _check_state(self, write=False):
         if self.tx.state is not STATE_PENDING:
             raise RuntimeError('Transaction in state "{state}" use is '
                                'prohibited'.format(state=self.tx.state))
+        if write and self.tx.readonly:
+            raise RuntimeError('Writes to read-only transaction are '
+                               'prohibited')
+        if self.tx.doomed:
+            raise exceptions.OptimisticLockFailure(self.tx.xid)
+
+    def _read(self, key, default=None):
+        self._check_state()
 
         tx = self.tx
         vd = tx._lookup(self.name, key)
         if vd is None:
             xid, doc = low_level.read(tx.conn, self.table, key,
-                                      default=MISSING)
+                                      default=MISSING,
+                                      read_mode=tx.read_mode,
+                                      resolve_pending=tx.resolve_pending,
+                                      write_back=tx._write_back(self.name),
+                                      own_xid=tx.xid, table_name=self.name)
             if doc is not MISSING:
-                vd = VersionedDocument(xid, doc)
+                vd = VersionedDocument(xid, self.codec.decode(doc))
                 tx._memoize(self.name, key, vd)
             else:
                 return VersionedDocument(xid, default)
         return vd
 
+    def _read_many(self, keys, default=None):
+        self._check_state()
+
+        tx = self.tx
+        result = {}
+        missing = []
+        for key in keys:
+            vd = tx._lookup(self.name, key)
+            if vd is None:
+                missing.append(key)
+            else:
+                result[key] = vd
+        if missing:
+            records = low_level.read_many(tx.conn, self.table, missing,
+                                          default=MISSING,
+                                          read_mode=tx.read_mode,
+                                          resolve_pending=tx.resolve_pending,
+                                          own_xid=tx.xid,
+                                          table_name=self.name)
+            for key, (xid, doc) in six.iteritems(records):
+                if doc is not MISSING:
+                    vd = VersionedDocument(xid, self.codec.decode(doc))
+                    tx._memoize(self.name, key, vd)
+                else:
+                    vd = VersionedDocument(xid, default)
+                result[key] = vd
+        return result
+
+    def _scan(self, query, batch_size, memoize, bounds=None):
+        self._check_state()
+
+        tx = self.tx
+        batches = low_level.scan(tx.conn, self.table, query, default=MISSING,
+                                 read_mode=tx.read_mode,
+                                 resolve_pending=tx.resolve_pending,
+                                 own_xid=tx.xid, batch_size=batch_size,
+                                 table_name=self.name)
+        for records, unsettled in batches:
+            batch = []
+            for key, (xid, doc) in records:
+                # Documents read or written before are yielded from session
+                vd = tx._lookup(self.name, key)
+                if vd is None:
+                    if doc is MISSING:
+                        continue
+                    vd = VersionedDocument(xid, self.codec.decode(doc))
+                    if memoize:
+                        tx._memoize(self.name, key, vd)
+                else:
+                    unsettled.add(key)
+                batch.append((key, vd))
+            if bounds is not None:
+                batch = self._in_range(batch, unsettled, bounds)
+            for key, vd in batch:
+                yield key, vd.doc
+
+    def _in_range(self, batch, unsettled, bounds):
+        # Documents that aren't the values matched by index are checked
+        # against the range the way they would be indexed once committed
+        rows = [{'id': key, 'value': self.codec.encode(vd.doc)}
+                for key, vd in batch if key in unsettled]
+        if not rows:
+            return batch
+        index_fn, lower, upper = bounds
+        inside = low_level.in_range(self.tx.conn, index_fn, lower, upper,
+                                    rows)
+        return [(key, vd) for key, vd in batch
+                if key not in unsettled or key in inside]
+
     def _write(self, key, old_vd, new_doc):
-        if self.tx.state is not STATE_PENDING:
-            raise RuntimeError('Transaction in state "{state}" use is '
-                               'prohibited'.format(state=self.tx.state))
+        self._check_state(write=True)
 
         tx = self.tx
-        low_level.write(tx.conn, tx.xid, self.table, key, old_vd.xid, new_doc)
+        if tx.buffered:
+            tx.buffer.setdefault(self.name, {}).setdefault(key, old_vd.xid)
+        else:
+            low_level.write(tx.conn, tx._begin(), self.table, key,
+                            old_vd.xid, self.codec.encode(new_doc),
+                            table_name=self.name)
+        tx.writes.setdefault(self.name, set()).add(key)
         tx._memoize(self.name, key, VersionedDocument(tx.xid, new_doc))
 
+    def _write_delta(self, key, old_vd, patch):
+        self._check_state(write=True)
+
+        tx = self.tx
+        low_level.write_delta(tx.conn, tx._begin(), self.table, key,
+                              old_vd.xid, patch, table_name=self.name)
+        tx.writes.setdefault(self.name, set()).add(key)
+        tx._memoize(self.name, key,
+                    PatchedDocument.patch(tx.xid, old_vd, patch))
+
     def get(self, key, default=MISSING):
         vd = self._read(key, default)
         if vd.doc is MISSING:
@@ -78,14 +209,84 @@ class Table(object):
         else:
             return vd.doc
 
+    def get_many(self, keys, default=MISSING):
+        result = {}
+        for key, vd in six.iteritems(self._read_many(keys, default)):
+            if vd.doc is MISSING:
+                raise exceptions.NotFound(key)
+            result[key] = vd.doc
+        return result
+
+    def scan(self, batch_size=low_level.SCAN_BATCH_SIZE, memoize=True):
+        return self._scan(low_level.scan_query(self.table), batch_size,
+                          memoize)
+
+    def between(self, index, lower, upper,
+                batch_size=low_level.SCAN_BATCH_SIZE, memoize=True,
+                index_fn=None):
+        bounds = None
+        if index_fn is not None:
+            bounds = index_fn, lower, upper
+        return self._scan(low_level.scan_query(self.table, index, lower,
+                                               upper),
+                          batch_size, memoize, bounds)
+
     def put(self, key, doc):
+        self._check_state(write=True)
         old_vd = self._read(key)
         self._write(key, old_vd, doc)
 
+    def bulk_put(self, items, chunk_size=low_level.WRITE_CHUNK_SIZE):
+        self._check_state(write=True)
+
+        # Documents written in bulk are not kept in session and their keys
+        # go to write-set records, so memory use doesn't grow with the
+        # number of documents
+        tx = self.tx
+        xid = tx._begin()
+        buffered = tx.buffer.get(self.name, {})
+        for chunk in low_level.chunks(items, chunk_size):
+            docs = dict(chunk)
+            old_xids = {}
+            missing = []
+            for key in docs:
+                vd = tx._lookup(self.name, key)
+                if vd is None:
+                    missing.append(key)
+                    continue
+                # Buffered write of the same key is superseded
+                if key in buffered:
+                    old_xids[key] = buffered.pop(key)
+                else:
+                    old_xids[key] = vd.xid
+                vd.xid, vd.doc = xid, docs[key]
+            if missing:
+                records = low_level.read_many(
+                    tx.conn, self.table, missing, read_mode=tx.read_mode,
+                    resolve_pending=tx.resolve_pending, own_xid=xid,
+                    table_name=self.name)
+                old_xids.update((key, record_xid) for key, (record_xid, _)
+                                in six.iteritems(records))
+            low_level.write_writeset(tx.conn, xid, tx.writesets, self.name,
+                                     list(docs))
+            tx.writesets += 1
+            encode = self.codec.encode
+            low_level.write_many(tx.conn, xid, self.table,
+                                 {key: (old_xids[key], encode(doc))
+                                  for key, doc in six.iteritems(docs)},
+                                 table_name=self.name)
+
     def update(self, key, data):
+        self._check_state(write=True)
         old_vd = self._read(key, MISSING)
-        if old_vd.doc is MISSING:
+        if not isinstance(old_vd, PatchedDocument) and old_vd.doc is MISSING:
             raise exceptions.NotFound(self.name, key)
+        # Buffered writes are staged as whole documents anyway, encoded
+        # documents can't be patched server-side
+        if (self.tx.delta and not self.tx.buffered and
+                self.codec is codec.PASSTHROUGH):
+            self._write_delta(key, old_vd, data)
+            return
         doc = dict(old_vd.doc)
         doc.update(data)
         self._write(key, old_vd, doc)
@@ -93,16 +294,79 @@ class Table(object):
 
 class Transaction(object):
     def __init__(self, conn=None, db=None, host='localhost',
-                 port=rethinkdb.DEFAULT_PORT):
+                 port=rethinkdb.DEFAULT_PORT, resolver=None,
+                 buffered=False, pool=None, readonly=False,
+                 read_mode='majority', contention=None,
+                 defer_write_back=False, pipelined=False, delta=False,
+                 codecs=None, watcher=None, priority=None):
+        if defer_write_back and resolver is None:
+            raise ValueError('Deferred write-back requires resolver')
+        self.pool = pool
+        self.owns_conn = conn is None
         if conn is None:
-            conn = rethinkdb.connect(host, port)
-        if db is not None:
-            conn.use(db)
+            if pool is not None:
+                conn = pool.acquire()
+            else:
+                conn = rethinkdb.connect(host, port)
         self.session = {}
         self.conn = conn
-        self.xid = low_level.create_tx(conn)
-        self.state = STATE_PENDING
-        LOG.debug('Started transaction #%s', self.xid)
+        self.resolver = resolver
+        # Pipelined transaction stages all its writes right before commit
+        self.buffered = buffered or pipelined
+        self.pipelined = pipelined
+        self.delta = delta
+        self.codecs = codecs or {}
+        self.buffer = {}
+        self.writes = {}
+        self.writesets = 0
+        self.readonly = readonly
+        self.read_mode = read_mode
+        self.contention = contention
+        self.defer_write_back = defer_write_back
+        self.watcher = watcher
+        # Set by watcher when transaction is aborted by someone else
+        self.doomed = False
+        self.resolve_pending = None
+        if contention is not None:
+            self.resolve_pending = self._resolve_pending
+        self.xid = None
+        self.timestamp = None
+        self.state = None
+        self.started = time.time()
+        # Retries pass priority of the first attempt, so transaction doesn't
+        # lose its age to the ones started later
+        self.priority = self.started if priority is None else priority
+        self.duration = None
+        self._round_trips = metrics.round_trips()
+        with self._finishing():
+            if db is not None:
+                conn.use(db)
+            self.state = STATE_PENDING
+
+    def _begin(self):
+        # Transaction record is created on first write, so transactions that
+        # never write don't touch transactions table at all
+        if self.xid is None:
+            self.xid, self.timestamp = low_level.begin_tx(self.conn,
+                                                          self.priority)
+            LOG.debug('Started transaction #%s', self.xid)
+            if self.watcher is not None:
+                self.watcher.watch(self)
+        return self.xid
+
+    def _resolve_pending(self, conn, owners):
+        # Requester without transaction record has no intents written, so
+        # it has no priority to compare
+        priority = self.priority if self.xid is not None else None
+        return self.contention.resolve(conn, priority, owners, self.xid)
+
+    def _write_back(self, table_name):
+        if not self.defer_write_back:
+            return None
+        return functools.partial(self.resolver.defer, table_name)
+
+    def _codec(self, table_name):
+        return self.codecs.get(table_name, codec.PASSTHROUGH)
 
     def table(self, name):
         return Table(self, name)
@@ -116,37 +380,117 @@ class Transaction(object):
     def _memoize(self, table_name, key, vd):
         self.session.setdefault(table_name, {})[key] = vd
 
+    def _clear(self, committed, writes_keys):
+        if self.resolver is not None:
+            if not writes_keys and not self.writesets:
+                return
+            try:
+                self.resolver.submit(self.xid, committed, writes_keys,
+                                     self.writesets)
+                return
+            except RuntimeError:
+                # Transaction is already finished, so its intents are
+                # cleared here rather than reported as failure
+                LOG.debug('Resolver is shut down, clearing intents of '
+                          'transaction #%s', self.xid)
+        for table_name, keys in six.iteritems(writes_keys):
+            table = rethinkdb.table(table_name)
+            low_level.clear(self.conn, self.xid, committed, table, keys,
+                            noreply=self.pipelined)
+        if self.writesets:
+            low_level.clear_writesets(self.conn, self.xid, committed,
+                                      self.writesets, noreply=self.pipelined)
+        if self.pipelined:
+            low_level.barrier(self.conn)
+
+    def _stage(self):
+        self._begin()
+        for table_name, old_xids in six.iteritems(self.buffer):
+            data = self.session[table_name]
+            encode = self._codec(table_name).encode
+            writes = {key: (old_xid, encode(data[key].doc))
+                      for key, old_xid in six.iteritems(old_xids)}
+            low_level.write_many(self.conn, self.xid,
+                                 rethinkdb.table(table_name), writes,
+                                 table_name=table_name)
+
+    def _release(self, broken=False):
+        if not self.owns_conn:
+            return
+        self.owns_conn = False
+        if self.pool is not None:
+            self.pool.release(self.conn, broken)
+        else:
+            self.conn.close(noreply_wait=False)
+
+    @contextlib.contextmanager
+    def _finishing(self):
+        try:
+            yield
+        except rethinkdb.ReqlDriverError:
+            self._release(broken=True)
+            raise
+        finally:
+            if self.state is not STATE_PENDING:
+                if self.watcher is not None and self.xid is not None:
+                    self.watcher.unwatch(self.xid)
+                self._release()
+                self._report()
+
+    def _report(self):
+        if self.state is None or self.duration is not None:
+            return
+        self.duration = time.time() - self.started
+        metrics.transaction(self.state, self.duration,
+                            metrics.round_trips() - self._round_trips)
+
     def commit(self):
-        writes_keys = {}
-        for table_name, data in six.iteritems(self.session):
-            keys = set()
-            for key, vd in six.iteritems(data):
-                if vd.xid == self.xid:
-                    keys.add(key)
+        with self._finishing():
+            self._commit()
 
-            if keys:
-                writes_keys[table_name] = keys
+    def _commit(self):
+        if self.doomed:
+            self.abort()
+            raise exceptions.OptimisticLockFailure(self.xid)
+
+        if self.buffer:
+            try:
+                self._stage()
+            except exceptions.OptimisticLockFailure:
+                self.abort()
+                raise
+
+        if self.xid is None:
+            LOG.debug('Finishing transaction without writes')
+            self.state = STATE_COMMITTED
+            return
 
         LOG.debug('Committing transaction #%s: writes=%s', self.xid,
-                  repr(writes_keys))
+                  repr(self.writes))
 
-        if low_level.commit(self.conn, self.xid, writes_keys):
+        if low_level.commit(self.conn, self.xid, self.writes):
             self.state = STATE_COMMITTED
-            for table_name, keys in six.iteritems(writes_keys):
-                table = rethinkdb.table(table_name)
-                low_level.clear(self.conn, self.xid, True, table, keys)
+            self._clear(True, self.writes)
         else:
+            for table_name, keys in six.iteritems(self.writes):
+                hotspots.conflicts(table_name, keys, 'commit')
             self.abort()
             raise exceptions.OptimisticLockFailure(self.xid)
 
     def abort(self):
+        with self._finishing():
+            self._abort()
+
+    def _abort(self):
+        if self.xid is None:
+            LOG.debug('Aborting transaction without writes')
+            self.state = STATE_ABORTED
+            return
+
         LOG.debug('Aborting transaction #%s', self.xid)
         if low_level.abort(self.conn, self.xid):
             self.state = STATE_ABORTED
-            for table_name, data in six.iteritems(self.session):
-                table = rethinkdb.table(table_name)
-                keys = six.iterkeys(data)
-                low_level.clear(self.conn, self.xid, False, table, keys)
+            self._clear(False, self.writes)
         else:
             raise exceptions.OptimisticLockFailure(self.xid)
 
@@ -154,10 +498,14 @@ class Transaction(object):
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        if self.state == STATE_PENDING:
-            if exc_val is not None:
-                LOG.debug('Aborting transaction #%s due to exception',
-                          self.xid, exc_info=(exc_type, exc_val, exc_tb))
-                self.abort()
-            else:
-                self.commit()
+        try:
+            if self.state == STATE_PENDING:
+                if exc_val is not None:
+                    LOG.debug('Aborting transaction #%s due to exception',
+                              self.xid, exc_info=(exc_type, exc_val, exc_tb))
+                    self.abort()
+                else:
+                    self.commit()
+        finally:
+            self._release(broken=isinstance(exc_val,
+                                            rethinkdb.ReqlDriverError))
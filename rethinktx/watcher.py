@@ -0,0 +1,95 @@
+# Copyright 2016, Anton Frolov <frolov.anton@gmail.com>
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import logging
+import threading
+import weakref
+
+import rethinkdb
+
+from rethinktx import low_level
+
+LOG = logging.getLogger(__name__)
+
+
+# Follows single changefeed of aborted transaction records on its own
+# connection and dooms watched transactions as soon as they are aborted by
+# someone else. Aborts missed while feed is down are still detected by
+# commit.
+class AbortWatcher(object):
+    def __init__(self, connect, poll_interval=0.5, retry_interval=1.0):
+        self._connect = connect
+        self.poll_interval = poll_interval
+        self.retry_interval = retry_interval
+        self._lock = threading.Lock()
+        # Transactions abandoned without commit or abort don't stay here
+        self._watched = weakref.WeakValueDictionary()
+        self._stop = threading.Event()
+        self.ready = threading.Event()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def watch(self, tx):
+        with self._lock:
+            self._watched[tx.xid] = tx
+
+    def unwatch(self, xid):
+        with self._lock:
+            self._watched.pop(xid, None)
+
+    def shutdown(self, wait=True):
+        self._stop.set()
+        if wait:
+            self._thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.shutdown()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                conn = self._connect()
+                try:
+                    self._follow(conn)
+                finally:
+                    self.ready.clear()
+                    conn.close(noreply_wait=False)
+            except rethinkdb.ReqlError:
+                LOG.exception('Aborted transactions feed failed')
+                self._stop.wait(self.retry_interval)
+
+    def _follow(self, conn):
+        feed = low_level.run_query(low_level.aborts_feed_query(), conn,
+                                   read_mode='single')
+        try:
+            self.ready.set()
+            while not self._stop.is_set():
+                try:
+                    change = feed.next(wait=self.poll_interval)
+                except rethinkdb.ReqlTimeoutError:
+                    continue
+                self._aborted(change['new_val']['id'])
+        finally:
+            feed.close()
+
+    def _aborted(self, xid):
+        with self._lock:
+            tx = self._watched.pop(xid, None)
+        if tx is not None:
+            LOG.debug('Transaction #%s was aborted by another client', xid)
+            tx.doomed = True
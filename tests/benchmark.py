@@ -0,0 +1,235 @@
+# Copyright 2016, Anton Frolov <frolov.anton@gmail.com>
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+# Throughput benchmark of the transaction protocol. Runs against database
+# given by RDB_HOST, RDB_PORT and RDB_DB environment variables or against
+# in-process mock when they are not set:
+#
+#     python -m tests.benchmark --threads 8 --keys 1000 --skew 0.9
+
+import argparse
+import bisect
+import json
+import logging
+import random
+import threading
+import time
+
+import rethinkdb
+import rethinktx
+import six
+from rethinktx import metrics
+from rethinktx import recovery
+from . import mocks
+
+LOG = logging.getLogger(__name__)
+LOAD_CHUNK_SIZE = 1000
+
+
+class ZipfGenerator(object):
+    def __init__(self, size, skew, rng):
+        self.rng = rng
+        weights = [1.0 / (rank + 1) ** skew for rank in six.moves.range(size)]
+        total = sum(weights)
+        self.cdf = []
+        cumulative = 0.0
+        for weight in weights:
+            cumulative += weight / total
+            self.cdf.append(cumulative)
+
+    def next(self):
+        index = bisect.bisect_left(self.cdf, self.rng.random())
+        return min(index, len(self.cdf) - 1)
+
+
+class Workload(object):
+    def __init__(self, table='bench', keys=1000, skew=0.0, read_ratio=0.5,
+                 keys_per_tx=2):
+        self.table = table
+        self.keys = keys
+        self.skew = skew
+        self.read_ratio = read_ratio
+        self.keys_per_tx = min(keys_per_tx, keys)
+
+    def key(self, index):
+        return 'key-%d' % index
+
+    def load(self, conn):
+        recovery.provision(conn, [self.table])
+        for chunk in key_ranges(self.keys):
+            with rethinktx.Transaction(conn, buffered=True) as tx:
+                table = tx.table(self.table)
+                for index in chunk:
+                    table.put(self.key(index), {'counter': 0})
+
+    def execute(self, conn, generator, rng):
+        keys = set()
+        while len(keys) < self.keys_per_tx:
+            keys.add(self.key(generator.next()))
+        readonly = rng.random() < self.read_ratio
+        with rethinktx.Transaction(conn, readonly=readonly) as tx:
+            table = tx.table(self.table)
+            for key in sorted(keys):
+                doc = table.get(key)
+                if not readonly:
+                    table.put(key, {'counter': doc['counter'] + 1})
+
+
+def key_ranges(size):
+    for start in six.moves.range(0, size, LOAD_CHUNK_SIZE):
+        yield six.moves.range(start, min(start + LOAD_CHUNK_SIZE, size))
+
+
+class Worker(threading.Thread):
+    def __init__(self, connect, workload, seed, deadline=None,
+                 transactions=None):
+        super(Worker, self).__init__()
+        self.daemon = True
+        self.connect = connect
+        self.workload = workload
+        self.rng = random.Random(seed)
+        self.deadline = deadline
+        self.transactions = transactions
+        self.errors = 0
+
+    def _done(self, executed):
+        if self.transactions is not None:
+            return executed >= self.transactions
+        return time.time() >= self.deadline
+
+    def run(self):
+        generator = ZipfGenerator(self.workload.keys, self.workload.skew,
+                                  self.rng)
+        conn = self.connect()
+        try:
+            executed = 0
+            while not self._done(executed):
+                executed += 1
+                try:
+                    self.workload.execute(conn, generator, self.rng)
+                except rethinktx.OptimisticLockFailure:
+                    pass
+                except rethinkdb.ReqlError:
+                    LOG.debug('Transaction failed', exc_info=True)
+                    self.errors += 1
+        finally:
+            conn.close()
+
+
+def run(connect, workload, threads=4, duration=10.0, transactions=None,
+        seed=None):
+    conn = connect()
+    try:
+        workload.load(conn)
+    finally:
+        conn.close()
+
+    collector = metrics.HistogramCollector()
+    previous = metrics.get_observer()
+    metrics.set_observer(collector)
+    rng = random.Random(seed)
+    started = time.time()
+    deadline = None if transactions is not None else started + duration
+    workers = [Worker(connect, workload, rng.random(), deadline, transactions)
+               for _ in six.moves.range(threads)]
+    try:
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+    finally:
+        metrics.set_observer(previous)
+    return report(collector.snapshot(), time.time() - started,
+                  sum(worker.errors for worker in workers))
+
+
+def report(snapshot, elapsed, errors):
+    transactions = snapshot['transactions']
+    commits = transactions.get('committed', {}).get('count', 0)
+    aborts = transactions.get('aborted', {}).get('count', 0)
+    finished = commits + aborts
+    return {
+        'elapsed': elapsed,
+        'commits': commits,
+        'aborts': aborts,
+        'errors': errors,
+        'commits_per_sec': commits / elapsed if elapsed else 0.0,
+        'abort_rate': aborts / float(finished) if finished else 0.0,
+        'transactions': transactions,
+        'operations': snapshot['operations'],
+        'round_trips': snapshot['round_trips'],
+        'intents': snapshot['intents'],
+        'lock_failures': snapshot['lock_failures'],
+    }
+
+
+def format_report(result):
+    lines = [
+        'elapsed: %.2fs' % result['elapsed'],
+        'commits: %d (%.1f/s)' % (result['commits'],
+                                  result['commits_per_sec']),
+        'aborts: %d (%.1f%%)' % (result['aborts'],
+                                 result['abort_rate'] * 100),
+        'errors: %d' % result['errors'],
+        '%-12s %8s %10s %10s %10s %10s' % ('latency', 'count', 'p50 ms',
+                                           'p95 ms', 'p99 ms', 'max ms'),
+    ]
+    rows = sorted(six.iteritems(result['operations']))
+    rows.extend(('tx ' + state, histogram) for state, histogram
+                in sorted(six.iteritems(result['transactions'])))
+    for name, histogram in rows:
+        lines.append('%-12s %8d %10.2f %10.2f %10.2f %10.2f' % (
+            name, histogram['count'], histogram['p50'] * 1000,
+            histogram['p95'] * 1000, histogram['p99'] * 1000,
+            histogram['max'] * 1000))
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Measure throughput of transaction protocol.')
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--keys', type=int, default=1000,
+                        help='number of keys in key space')
+    parser.add_argument('--skew', type=float, default=0.0,
+                        help='Zipf exponent of key popularity, 0 is uniform')
+    parser.add_argument('--read-ratio', type=float, default=0.5,
+                        help='fraction of read-only transactions')
+    parser.add_argument('--keys-per-tx', type=int, default=2)
+    parser.add_argument('--duration', type=float, default=10.0,
+                        help='seconds to run')
+    parser.add_argument('--transactions', type=int, default=None,
+                        help='transactions per thread, overrides duration')
+    parser.add_argument('--table', default='bench')
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='seconds added to every query of in-process '
+                             'database')
+    parser.add_argument('--json', action='store_true',
+                        help='print report as JSON')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING)
+    workload = Workload(args.table, args.keys, args.skew, args.read_ratio,
+                        args.keys_per_tx)
+    result = run(mocks.connection_factory(args.latency), workload,
+                 args.threads, args.duration, args.transactions, args.seed)
+    if args.json:
+        print(json.dumps(result, indent=2, sort_keys=True))
+    else:
+        print(format_report(result))
+
+
+if __name__ == '__main__':
+    main()
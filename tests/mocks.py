@@ -12,13 +12,19 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import base64
 import copy
 import datetime
+import functools
 import os
 import six
+import threading
+import time
 
 import rethinkdb
 
+ast = rethinkdb.ast
+
 
 def get_arg(term, index):
     return term._args[index]
@@ -28,187 +34,563 @@ def get_args(term):
     return term._args
 
 
-class ConnectionMock(object):
-    def __init__(self):
-        self.db = None
-        self.tables = {}
+def new_result(return_changes=False):
+    result = {
+        'deleted': 0,
+        'errors': 0,
+        'inserted': 0,
+        'replaced': 0,
+        'skipped': 0,
+        'unchanged': 0,
+    }
+    if return_changes:
+        result['changes'] = []
+    return result
 
-    def __enter__(self):
+
+def add_result(result, other):
+    for k, v in six.iteritems(other):
+        if k == 'changes':
+            result.setdefault('changes', []).extend(v)
+        elif isinstance(v, int):
+            result[k] = result.get(k, 0) + v
+        elif k not in result:
+            result[k] = v
+    return result
+
+
+class Literal(object):
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+
+def merge(doc, patch):
+    doc = dict(doc)
+    for k, v in six.iteritems(patch):
+        if isinstance(v, Literal):
+            doc[k] = v.value
+        elif isinstance(v, dict) and isinstance(doc.get(k), dict):
+            doc[k] = merge(doc[k], v)
+        else:
+            doc[k] = unwrap(v)
+    return doc
+
+
+def unwrap(value):
+    if isinstance(value, Literal):
+        return value.value
+    if isinstance(value, dict):
+        return {k: unwrap(v) for k, v in six.iteritems(value)}
+    return value
+
+
+# Changefeed: changes are queued as they happen until the reader takes them
+class Feed(object):
+    def __init__(self, table):
+        self.table = table
+        self.predicate = None
+        self.changes = six.moves.queue.Queue()
+        table.subscribe(self)
+
+    def push(self, old, new):
+        self.changes.put({'old_val': old, 'new_val': new})
+
+    def where(self, predicate):
+        self.predicate = predicate
         return self
 
-    def __exit__(self, exc_type, exc_val, exc_tb):
-        return
+    def __iter__(self):
+        return self
 
-    def use(self, db):
-        self.db = db
+    def __next__(self):
+        return self.next()
 
-    def _start(self, term, **global_optargs):
-        ctx = {
-            'result': {
-                'deleted': 0,
-                'errors': 0,
-                'inserted': 0,
-                'replaced': 0,
-                'skipped': 0,
-                'unchanged': 0,
-            }
+    def next(self, wait=True):
+        timeout = None if wait is True else float(wait)
+        while True:
+            try:
+                change = self.changes.get(timeout=timeout)
+            except six.moves.queue.Empty:
+                raise rethinkdb.ReqlTimeoutError()
+            if self.predicate is None or self.predicate(change):
+                return copy.deepcopy(change)
+
+    def close(self):
+        self.table.unsubscribe(self)
+
+
+class Table(object):
+    def __init__(self):
+        self.docs = {}
+        self.indexes = {}
+        self.feeds = []
+        self.lock = threading.Lock()
+
+    def subscribe(self, feed):
+        with self.lock:
+            self.feeds.append(feed)
+
+    def unsubscribe(self, feed):
+        with self.lock:
+            if feed in self.feeds:
+                self.feeds.remove(feed)
+
+    def _notify(self, old, new):
+        for feed in self.feeds:
+            feed.push(old, new)
+
+    def get(self, key):
+        return self.docs.get(key)
+
+    def snapshot(self):
+        with self.lock:
+            return list(self.docs.values())
+
+    def insert(self, doc, conflict):
+        key = doc['id']
+        with self.lock:
+            old = self.docs.get(key)
+            if old is not None and conflict == 'error':
+                raise RuntimeError('conflict')
+            if old is not None and conflict == 'update':
+                new = dict(old)
+                new.update(doc)
+                doc = new
+            self.docs[key] = doc
+            self._notify(old, doc)
+            return old, doc
+
+    def replace(self, key, old, new):
+        # Documents are never changed in place, so identity check is enough
+        # to detect concurrent update of the same document
+        with self.lock:
+            if self.docs.get(key) is not old:
+                return False
+            self.docs[key] = new
+            self._notify(old, new)
+            return True
+
+    def delete(self, key):
+        with self.lock:
+            old = self.docs.pop(key, None)
+            if old is not None:
+                self._notify(old, None)
+            return old
+
+
+# Evaluates queries against in-memory tables. Stored documents are replaced
+# rather than modified, so terms are evaluated without copying anything and
+# each document is updated atomically, like RethinkDb does. Only the result
+# returned to client is copied.
+class Engine(object):
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.tables = {}
+        self._lock = threading.Lock()
+        self._handlers = {
+            ast.Get: self._eval_get,
+            ast.GetAll: self._eval_get_all,
+            ast.ForEach: self._eval_for_each,
+            ast.Delete: self._eval_delete,
+            ast.Insert: self._eval_insert,
+            ast.Update: self._eval_update,
+            ast.MakeObj: self._eval_make_obj,
+            ast.MakeArray: self._eval_make_array,
+            ast.Datum: lambda ctx, term: term.data,
+            ast.Bracket: self._binary(lambda lhs, rhs: lhs[rhs]),
+            ast.Add: self._binary(lambda lhs, rhs: lhs + rhs),
+            ast.Eq: self._binary(lambda lhs, rhs: lhs == rhs),
+            ast.Ne: self._binary(lambda lhs, rhs: lhs != rhs),
+            ast.Lt: self._binary(lambda lhs, rhs: lhs < rhs),
+            ast.CoerceTo: self._eval_coerce_to,
+            ast.Ge: self._binary(lambda lhs, rhs: lhs >= rhs),
+            ast.Sub: self._binary(self._sub),
+            ast.Or: self._eval_or,
+            ast.And: self._eval_and,
+            ast.Filter: self._eval_filter,
+            ast.Count: self._eval_count,
+            ast.Limit: self._eval_limit,
+            ast.Between: self._eval_between,
+            ast.OrderBy: self._eval_order_by,
+            ast.Pluck: self._eval_pluck,
+            ast.TableList: self._eval_table_list,
+            ast.TableListTL: self._eval_table_list,
+            ast.TableCreate: self._eval_table_create,
+            ast.TableCreateTL: self._eval_table_create,
+            ast.IndexList: self._eval_index_list,
+            ast.IndexCreate: self._eval_index_create,
+            ast.IndexWait: lambda ctx, term: [],
+            rethinkdb.query.RqlConstant: lambda ctx, term: term,
+            ast.ImplicitVar: lambda ctx, term: ctx['implicit_var'],
+            ast.Var: self._eval_var,
+            ast.Branch: self._eval_branch,
+            ast.Table: self._eval_table,
+            ast.Now: lambda ctx, term: datetime.datetime.now(),
+            ast.Func: lambda ctx, term: self._eval(ctx, get_arg(term, 1)),
+            ast.FunCall: self._eval_fun_call,
+            ast.Merge: self._eval_merge,
+            ast.Literal: lambda ctx, term: Literal(
+                self._eval(ctx, get_arg(term, 0))),
+            ast.UserError: self._eval_user_error,
+            ast.Changes: lambda ctx, term: Feed(
+                self._eval(ctx, get_arg(term, 0))),
+            ast.Binary: lambda ctx, term: base64.b64decode(term.base64_data),
         }
-        self._affect_context_by_optargs(ctx, global_optargs)
+
+    def table(self, name):
+        table = self.tables.get(name)
+        if table is None:
+            with self._lock:
+                table = self.tables.setdefault(name, Table())
+        return table
+
+    def run(self, term, global_optargs):
+        if self.latency:
+            time.sleep(self.latency)
         try:
-            return self._eval_term(ctx, term)
+            result = self._eval_sequence({}, term)
         except RuntimeError as ex:
-            result = ctx['result']
+            result = new_result()
             result['errors'] += 1
             result['error'] = ex.args[0]
+        if isinstance(result, Feed):
             return result
+        if global_optargs.get('noreply'):
+            return None
+        return copy.deepcopy(result)
 
-    def _affect_context_by_optargs(self, ctx, optargs):
-        if 'return_changes' in optargs:
-            ctx['return_changes'] = self._eval_term(ctx,
-                                                    optargs['return_changes'])
-            if ctx['return_changes']:
-                ctx['result']['changes'] = []
-        if 'conflict' in optargs:
-            ctx['conflict'] = self._eval_term(ctx, optargs['conflict'])
-
-    def _eval_term(self, ctx, term):
-        if not isinstance(term, rethinkdb.ast.RqlQuery):
+    def _eval(self, ctx, term):
+        if not isinstance(term, ast.RqlQuery):
             return term
-        local_ctx = copy.deepcopy(ctx)
-        self._affect_context_by_optargs(local_ctx, term.optargs)
-        if isinstance(term, rethinkdb.ast.Get):
-            table = self._eval_term(local_ctx, get_arg(term, 0))
-            key = self._eval_term(local_ctx, get_arg(term, 1))
-            return table.get(key)
-        elif isinstance(term, rethinkdb.ast.Insert):
-            return self._eval_insert(local_ctx, term)
-        elif isinstance(term, rethinkdb.ast.Update):
-            return self._eval_update(local_ctx, term)
-        elif isinstance(term, rethinkdb.ast.MakeObj):
-            return {k: self._eval_term(local_ctx, v)
-                    for k, v in six.iteritems(term.optargs)}
-        elif isinstance(term, rethinkdb.ast.MakeArray):
-            return [self._eval_term(local_ctx, x) for x in get_args(term)]
-        elif isinstance(term, rethinkdb.ast.Datum):
-            return term.data
-        elif isinstance(term, rethinkdb.ast.Bracket):
-            lhs = self._eval_term(local_ctx, get_arg(term, 0))
-            rhs = self._eval_term(local_ctx, get_arg(term, 1))
-            return lhs[rhs]
-        elif isinstance(term, rethinkdb.ast.Add):
-            lhs = self._eval_term(local_ctx, get_arg(term, 0))
-            rhs = self._eval_term(local_ctx, get_arg(term, 1))
-            return lhs + rhs
-        elif isinstance(term, rethinkdb.ast.Eq):
-            lhs = self._eval_term(local_ctx, get_arg(term, 0))
-            rhs = self._eval_term(local_ctx, get_arg(term, 1))
-            return lhs == rhs
-        elif isinstance(term, rethinkdb.ast.Ne):
-            lhs = self._eval_term(local_ctx, get_arg(term, 0))
-            rhs = self._eval_term(local_ctx, get_arg(term, 1))
-            return lhs != rhs
-        elif isinstance(term, rethinkdb.ast.And):
-            lhs = self._eval_term(local_ctx, get_arg(term, 0))
-            rhs = self._eval_term(local_ctx, get_arg(term, 1))
-            return lhs and rhs
-        elif isinstance(term, rethinkdb.ast.ImplicitVar):
-            return local_ctx['implicit_var']
-        elif isinstance(term, rethinkdb.ast.Branch):
-            if self._eval_term(local_ctx, get_arg(term, 0)):
-                return self._eval_term(local_ctx, get_arg(term, 1))
-            else:
-                return self._eval_term(local_ctx, get_arg(term, 2))
-        elif isinstance(term, rethinkdb.ast.Table):
-            table_name = self._eval_term(local_ctx, get_arg(term, 0))
-            return self.tables.setdefault(table_name, {})
-        elif isinstance(term, rethinkdb.ast.Now):
-            return datetime.datetime.now()
-        elif isinstance(term, rethinkdb.ast.Func):
-            # Just ignore function and eval the body
-            return self._eval_term(local_ctx, get_arg(term, 1))
-        elif isinstance(term, rethinkdb.ast.UserError):
-            raise RuntimeError(self._eval_term(local_ctx, get_arg(term, 0)))
-        else:
+        handler = self._handlers.get(term.__class__)
+        if handler is None:
             raise AssertionError(
                 'Term class ' + repr(term.__class__) + ' not supported')
+        return handler(ctx, term)
+
+    def _optarg(self, ctx, term, name, default=None):
+        if name not in term.optargs:
+            return default
+        return self._eval(ctx, term.optargs[name])
+
+    def _call(self, ctx, func, *args):
+        local_ctx = dict(ctx)
+        if isinstance(func, ast.Func):
+            var_ids = [self._eval(ctx, var_id)
+                       for var_id in get_args(get_arg(func, 0))]
+            local_ctx['vars'] = dict(ctx.get('vars', {}))
+            local_ctx['vars'].update(zip(var_ids, args))
+        if args:
+            local_ctx['implicit_var'] = args[0]
+        return self._eval(local_ctx, func)
+
+    def _binary(self, fn):
+        def handler(ctx, term):
+            return fn(self._eval(ctx, get_arg(term, 0)),
+                      self._eval(ctx, get_arg(term, 1)))
+        return handler
 
     @staticmethod
-    def _insert_value(ctx, table, key, value):
-        result = ctx['result']
-        table[key] = value
-        result['inserted'] += 1
-        if ctx.get('return_changes'):
-            result['changes'].append({
-                'old_val': None,
-                'new_val': copy.deepcopy(value),
-            })
+    def _sub(lhs, rhs):
+        if isinstance(lhs, datetime.datetime):
+            rhs = datetime.timedelta(seconds=rhs)
+        return lhs - rhs
+
+    def _eval_table(self, ctx, term):
+        return self.table(self._eval(ctx, get_arg(term, 0)))
+
+    def _table_of(self, ctx, term):
+        while not isinstance(term, ast.Table):
+            term = get_arg(term, 0)
+        return self._eval_table(ctx, term)
+
+    def _eval_sequence(self, ctx, term):
+        seq = self._eval(ctx, term)
+        if isinstance(seq, Table):
+            return seq.snapshot()
+        return seq
+
+    def _eval_get(self, ctx, term):
+        table = self._eval(ctx, get_arg(term, 0))
+        return table.get(self._eval(ctx, get_arg(term, 1)))
+
+    def _eval_get_all(self, ctx, term):
+        table = self._eval(ctx, get_arg(term, 0))
+        docs = [table.get(self._eval(ctx, arg))
+                for arg in get_args(term)[1:]]
+        return [doc for doc in docs if doc is not None]
+
+    def _eval_make_obj(self, ctx, term):
+        return {k: self._eval(ctx, v) for k, v in six.iteritems(term.optargs)}
+
+    def _eval_make_array(self, ctx, term):
+        return [self._eval(ctx, arg) for arg in get_args(term)]
+
+    def _eval_or(self, ctx, term):
+        return (self._eval(ctx, get_arg(term, 0)) or
+                self._eval(ctx, get_arg(term, 1)))
+
+    def _eval_and(self, ctx, term):
+        return (self._eval(ctx, get_arg(term, 0)) and
+                self._eval(ctx, get_arg(term, 1)))
+
+    def _eval_var(self, ctx, term):
+        return ctx['vars'][self._eval(ctx, get_arg(term, 0))]
+
+    def _eval_branch(self, ctx, term):
+        args = get_args(term)
+        for i in six.moves.range(0, len(args) - 1, 2):
+            if self._eval(ctx, args[i]):
+                return self._eval(ctx, args[i + 1])
+        return self._eval(ctx, args[-1])
+
+    def _eval_fun_call(self, ctx, term):
+        args = [self._eval(ctx, arg) for arg in get_args(term)[1:]]
+        return self._call(ctx, get_arg(term, 0), *args)
+
+    def _eval_merge(self, ctx, term):
+        doc = self._eval(ctx, get_arg(term, 0))
+        for arg in get_args(term)[1:]:
+            doc = merge(doc, self._eval(ctx, arg))
+        return doc
+
+    def _eval_user_error(self, ctx, term):
+        raise RuntimeError(self._eval(ctx, get_arg(term, 0)))
+
+    def _eval_filter(self, ctx, term):
+        seq = self._eval_sequence(ctx, get_arg(term, 0))
+        predicate = get_arg(term, 1)
+        if isinstance(seq, Feed):
+            return seq.where(functools.partial(self._matches, ctx, predicate))
+        if not isinstance(predicate, ast.Func):
+            fields = self._eval(ctx, predicate)
+            return [doc for doc in seq
+                    if all(doc.get(k) == v for k, v in six.iteritems(fields))]
+        return [doc for doc in seq if self._call(ctx, predicate, doc)]
+
+    def _matches(self, ctx, predicate, doc):
+        # Errors are treated as false, like filter does by default
+        try:
+            return self._call(ctx, predicate, doc)
+        except (KeyError, TypeError, RuntimeError):
+            return False
+
+    def _eval_coerce_to(self, ctx, term):
+        assert self._eval(ctx, get_arg(term, 1)) == 'array'
+        return list(self._eval_sequence(ctx, get_arg(term, 0)))
+
+    def _eval_count(self, ctx, term):
+        return len(self._eval_sequence(ctx, get_arg(term, 0)))
+
+    def _eval_limit(self, ctx, term):
+        seq = self._eval_sequence(ctx, get_arg(term, 0))
+        return seq[:self._eval(ctx, get_arg(term, 1))]
+
+    def _eval_between(self, ctx, term):
+        table = self._eval(ctx, get_arg(term, 0))
+        lower = self._eval(ctx, get_arg(term, 1))
+        upper = self._eval(ctx, get_arg(term, 2))
+        left_open = self._optarg(ctx, term, 'left_bound') == 'open'
+        name = self._optarg(ctx, term, 'index', 'id')
+        index = table.indexes.get(name)
+        assert index is not None or name == 'id'
+        selected = []
+        for doc in table.snapshot():
+            try:
+                if index is None:
+                    value = doc['id']
+                else:
+                    value = self._call(ctx, index, doc)
+            except RuntimeError:
+                continue
+            if lower is not rethinkdb.minval and (
+                    value < lower or left_open and value == lower):
+                continue
+            if upper is not rethinkdb.maxval and value >= upper:
+                continue
+            selected.append((value, doc))
+        selected.sort(key=lambda item: item[0])
+        return [doc for _, doc in selected]
+
+    def _eval_order_by(self, ctx, term):
+        # Only ordering by index right after between is supported, and
+        # between already returns documents in index order
+        assert isinstance(get_arg(term, 0), ast.Between)
+        return self._eval(ctx, get_arg(term, 0))
+
+    def _eval_pluck(self, ctx, term):
+        seq = self._eval_sequence(ctx, get_arg(term, 0))
+        fields = [self._eval(ctx, arg) for arg in get_args(term)[1:]]
+        return [{k: doc[k] for k in fields if k in doc} for doc in seq]
+
+    def _eval_table_list(self, ctx, term):
+        return list(self.tables)
+
+    def _eval_table_create(self, ctx, term):
+        self.table(self._eval(ctx, get_args(term)[-1]))
+        return {'tables_created': 1}
+
+    def _eval_index_list(self, ctx, term):
+        return list(self._eval(ctx, get_arg(term, 0)).indexes)
+
+    def _eval_index_create(self, ctx, term):
+        table = self._eval(ctx, get_arg(term, 0))
+        table.indexes[self._eval(ctx, get_arg(term, 1))] = get_arg(term, 2)
+        return {'created': 1}
+
+    def _eval_for_each(self, ctx, term):
+        result = new_result()
+        for item in self._eval(ctx, get_arg(term, 0)):
+            add_result(result, self._call(ctx, get_arg(term, 1), item))
         return result
 
-    @staticmethod
-    def _update_value(ctx, new_value, value):
-        result = ctx['result']
-        for k, v in six.iteritems(value):
-            if k not in new_value:
-                break
-            if new_value[k] != v:
+    def _selection(self, ctx, term):
+        table = self._table_of(ctx, term)
+        if isinstance(term, ast.Get):
+            return table, [self._eval(ctx, get_arg(term, 1))]
+        return table, [doc['id'] for doc in self._eval_sequence(ctx, term)]
+
+    def _eval_insert(self, ctx, term):
+        table = self._eval(ctx, get_arg(term, 0))
+        docs = self._eval(ctx, get_arg(term, 1))
+        conflict = self._optarg(ctx, term, 'conflict', 'error')
+        return_changes = self._optarg(ctx, term, 'return_changes', False)
+        result = new_result(return_changes)
+        if not isinstance(docs, list):
+            docs = [docs]
+        for doc in docs:
+            try:
+                old, new = table.insert(doc, conflict)
+            except RuntimeError as ex:
+                self._error(result, ex.args[0])
+                continue
+            if old is None:
+                result['inserted'] += 1
+            else:
+                result['replaced'] += 1
+            if return_changes:
+                result['changes'].append({'old_val': old, 'new_val': new})
+        return result
+
+    def _eval_update(self, ctx, term):
+        table, keys = self._selection(ctx, get_arg(term, 0))
+        return_changes = self._optarg(ctx, term, 'return_changes', False)
+        result = new_result(return_changes)
+        for key in keys:
+            self._update_doc(ctx, table, key, get_arg(term, 1), result,
+                             return_changes)
+        return result
+
+    def _update_doc(self, ctx, table, key, func, result, return_changes):
+        while True:
+            old = table.get(key)
+            if old is None:
+                result['skipped'] += 1
+                return
+            try:
+                patch = self._call(ctx, func, old)
+            except RuntimeError as ex:
+                self._error(result, ex.args[0])
+                return
+            # Nested objects are merged unless wrapped in literal, like
+            # RethinkDb does
+            new = merge(old, patch)
+            if new == old:
+                result['unchanged'] += 1
+                if return_changes == 'always':
+                    result['changes'].append({'old_val': old, 'new_val': old})
+                return
+            if table.replace(key, old, new):
                 break
-        else:
-            if ctx.get('return_changes') == 'always':
-                old_value = copy.deepcopy(new_value)
-                result['changes'].append({
-                    'old_val': old_value,
-                    'new_val': old_value,
-                })
-            result['unchanged'] += 1
-            return result
-        old_value = copy.deepcopy(new_value)
-        new_value.update(value)
-        if ctx.get('return_changes'):
-            result['changes'].append({
-                'old_val': old_value,
-                'new_val': copy.deepcopy(new_value),
-            })
         result['replaced'] += 1
+        if return_changes:
+            result['changes'].append({'old_val': old, 'new_val': new})
+
+    def _eval_delete(self, ctx, term):
+        table, keys = self._selection(ctx, get_arg(term, 0))
+        result = new_result()
+        for key in keys:
+            if table.delete(key) is None:
+                result['skipped'] += 1
+            else:
+                result['deleted'] += 1
         return result
 
     @staticmethod
-    def _skip_value(ctx):
-        result = ctx['result']
-        result['skipped'] += 1
-        return result
+    def _error(result, message):
+        result['errors'] += 1
+        result.setdefault('first_error', message)
 
-    def _eval_insert(self, local_ctx, term):
-        table = self._eval_term(local_ctx, get_arg(term, 0))
-        value = self._eval_term(local_ctx, get_arg(term, 1))
-        key = value['id']
-        conflict = local_ctx.get('conflict', 'error')
-        if key not in table or conflict == 'replace':
-            return self._insert_value(local_ctx, table, key, value)
-        elif conflict == 'error':
-            raise RuntimeError('conflict')
-        elif conflict == 'update':
-            return self._update_value(local_ctx, table[key], value)
-
-    def _eval_update(self, local_ctx, term):
-        curr_value = self._eval_term(local_ctx, get_arg(term, 0))
-        if curr_value is None:
-            return self._skip_value(local_ctx)
-        else:
-            local_ctx['implicit_var'] = curr_value
-            updated_data = self._eval_term(local_ctx, get_arg(term, 1))
-            return self._update_value(local_ctx, curr_value, updated_data)
 
+class ConnectionMock(object):
+    def __init__(self, engine=None, latency=0.0):
+        self.engine = engine if engine is not None else Engine(latency)
+        self.db = None
+
+    @property
+    def tables(self):
+        return self.engine.tables
 
-def get_connection():
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return
+
+    def close(self, noreply_wait=True):
+        return
+
+    def is_open(self):
+        return True
+
+    def reconnect(self, noreply_wait=True):
+        return self
+
+    def noreply_wait(self):
+        return
+
+    def use(self, db):
+        self.db = db
+
+    def _start(self, term, **global_optargs):
+        return self.engine.run(term, global_optargs)
+
+
+def _connect_params():
     port = int(os.environ.get('RDB_PORT', '0'))
     host = os.environ.get('RDB_HOST', '')
     db = os.environ.get('RDB_DB', '')
     if port and host and db:
-        return rethinkdb.connect(host=host, port=port, db=db)
+        return {'host': host, 'port': port, 'db': db}
+    return None
+
+
+def get_connection():
+    params = _connect_params()
+    if params is not None:
+        return rethinkdb.connect(**params)
     else:
         return ConnectionMock()
 
 
+# Returns callable creating connections to the same database: either real
+# one or single in-process engine shared by all connections
+def connection_factory(latency=0.0):
+    params = _connect_params()
+    if params is not None:
+        return lambda: rethinkdb.connect(**params)
+    engine = Engine(latency)
+    return lambda: ConnectionMock(engine)
+
+
+def connect_like(conn):
+    if isinstance(conn, ConnectionMock):
+        return ConnectionMock(conn.engine)
+    return get_connection()
+
+
 def cleanup_connection(conn):
     if isinstance(conn, ConnectionMock):
         return
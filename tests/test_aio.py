@@ -0,0 +1,151 @@
+# Copyright 2016, Anton Frolov <frolov.anton@gmail.com>
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+import asyncio
+
+import rethinkdb
+import rethinktx
+from rethinktx import aio
+from . import mocks
+
+import unittest
+
+
+# Like cursor of asyncio driver, can't be iterated synchronously
+class AsyncCursorMock(object):
+    def __init__(self, items):
+        self.items = list(items)
+
+    async def fetch_next(self):
+        return bool(self.items)
+
+    async def next(self):
+        return self.items.pop(0)
+
+
+class AsyncConnectionMock(mocks.ConnectionMock):
+    STREAMS = (rethinkdb.ast.Table, rethinkdb.ast.GetAll,
+               rethinkdb.ast.Between, rethinkdb.ast.Filter)
+
+    def _start(self, term, **global_optargs):
+        result = super(AsyncConnectionMock, self)._start(term,
+                                                         **global_optargs)
+        if isinstance(term, self.STREAMS):
+            result = AsyncCursorMock(result)
+        future = asyncio.get_event_loop().create_future()
+        future.set_result(result)
+        return future
+
+
+# Result is delivered on the next loop iteration, so concurrent coroutines
+# interleave like they do with real driver
+class YieldingConnectionMock(mocks.ConnectionMock):
+    def _start(self, term, **global_optargs):
+        future = asyncio.get_event_loop().create_future()
+        asyncio.get_event_loop().call_soon(
+            future.set_result,
+            super(YieldingConnectionMock, self)._start(term, **global_optargs))
+        return future
+
+
+class AsyncTransactionTestCase(unittest.TestCase):
+    def setUp(self):
+        super(AsyncTransactionTestCase, self).setUp()
+        with mocks.get_connection() as conn:
+            if not isinstance(conn, mocks.ConnectionMock):
+                self.skipTest('Asyncio connection required')
+        self.conn = AsyncConnectionMock()
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+    def tearDown(self):
+        super(AsyncTransactionTestCase, self).tearDown()
+        asyncio.set_event_loop(None)
+        self.loop.close()
+
+    def _run(self, coro):
+        return self.loop.run_until_complete(coro)
+
+    def test_put_get(self):
+        async def scenario():
+            async with aio.AsyncTransaction(self.conn) as tx:
+                await tx.table('table1').put('key-1', 'data1')
+                await tx.table('table1').put('key-2', 'data2')
+
+            async with aio.AsyncTransaction(self.conn) as tx:
+                table = tx.table('table1')
+                self.assertEqual('data1', await table.get('key-1'))
+                self.assertEqual({'key-1': 'data1', 'key-2': 'data2'},
+                                 await table.get_many(['key-1', 'key-2']))
+                with self.assertRaises(rethinktx.NotFound):
+                    await table.get('key-3')
+
+        self._run(scenario())
+
+    def test_concurrent_overlapping(self):
+        async def scenario():
+            tx1 = await aio.AsyncTransaction(self.conn).begin()
+            tx2 = await aio.AsyncTransaction(self.conn).begin()
+            await tx1.table('table1').put('key', 'data1')
+            await tx2.table('table1').put('key', 'data2')
+            with self.assertRaises(rethinktx.OptimisticLockFailure):
+                await tx1.commit()
+            await tx2.commit()
+
+            async with aio.AsyncTransaction(self.conn) as tx:
+                self.assertEqual('data2', await tx.table('table1').get('key'))
+
+        self._run(scenario())
+
+    def test_get_many_resolves_intents(self):
+        async def scenario():
+            tx1 = aio.AsyncTransaction(self.conn)
+            await tx1.table('table1').put('key-1', 'data1')
+
+            async with aio.AsyncTransaction(self.conn) as tx2:
+                self.assertEqual({'key-1': 'default'},
+                                 await tx2.table('table1').get_many(
+                                     ['key-1'], default='default'))
+            with self.assertRaises(rethinktx.OptimisticLockFailure):
+                await tx1.commit()
+
+        self._run(scenario())
+
+    def test_without_context_manager(self):
+        async def scenario():
+            tx = aio.AsyncTransaction(self.conn)
+            await tx.table('table1').put('key-1', 'data1')
+            await tx.commit()
+
+            tx = aio.AsyncTransaction(self.conn)
+            self.assertEqual('data1', await tx.table('table1').get('key-1'))
+
+        self._run(scenario())
+
+    def test_concurrent_writes(self):
+        conn = YieldingConnectionMock()
+
+        async def scenario():
+            async with aio.AsyncTransaction(conn) as tx:
+                table = tx.table('table1')
+                await asyncio.gather(table.put('key-1', 'data1'),
+                                     table.put('key-2', 'data2'))
+
+            self.assertEqual(1, await rethinkdb.table(
+                'transactions').count().run(conn))
+            async with aio.AsyncTransaction(conn) as tx:
+                self.assertEqual({'key-1': 'data1', 'key-2': 'data2'},
+                                 await tx.table('table1').get_many(
+                                     ['key-1', 'key-2']))
+
+        self._run(scenario())
@@ -0,0 +1,37 @@
+# Copyright 2016, Anton Frolov <frolov.anton@gmail.com>
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+import random
+
+from . import benchmark
+from . import mocks
+
+import unittest
+
+
+class BenchmarkTestCase(unittest.TestCase):
+    def test_zipf_prefers_low_ranks(self):
+        generator = benchmark.ZipfGenerator(100, 1.5, random.Random(1))
+        samples = [generator.next() for _ in range(1000)]
+        self.assertTrue(all(0 <= sample < 100 for sample in samples))
+        self.assertGreater(samples.count(0), samples.count(50) * 10)
+
+    def test_run(self):
+        workload = benchmark.Workload(keys=20, skew=1.0, read_ratio=0.5,
+                                      keys_per_tx=2)
+        result = benchmark.run(mocks.connection_factory(), workload,
+                               threads=2, transactions=20, seed=1)
+        self.assertEqual(40, result['commits'] + result['aborts'])
+        self.assertEqual(0, result['errors'])
+        self.assertIn('read', result['operations'])
+        self.assertIn('commits:', benchmark.format_report(result))
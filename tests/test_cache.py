@@ -0,0 +1,69 @@
+# Copyright 2016, Anton Frolov <frolov.anton@gmail.com>
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+import rethinkdb
+import rethinktx
+from rethinktx import cache
+from rethinktx import low_level
+from . import mocks
+
+import unittest
+
+
+class StatusCacheTestCase(unittest.TestCase):
+    def test_only_terminal_states_cached(self):
+        status_cache = cache.StatusCache()
+        status_cache.put('xid-1', 'pending')
+        status_cache.put('xid-2', 'committed')
+        self.assertIsNone(status_cache.get('xid-1'))
+        self.assertEqual('committed', status_cache.get('xid-2'))
+        self.assertEqual(1, status_cache.hits)
+        self.assertEqual(1, status_cache.misses)
+
+    def test_lru_eviction(self):
+        status_cache = cache.StatusCache(max_size=2)
+        status_cache.put('xid-1', 'committed')
+        status_cache.put('xid-2', 'aborted')
+        status_cache.get('xid-1')
+        status_cache.put('xid-3', 'aborted')
+        self.assertEqual(2, len(status_cache))
+        self.assertIsNone(status_cache.get('xid-2'))
+        self.assertEqual('committed', status_cache.get('xid-1'))
+        self.assertEqual('aborted', status_cache.get('xid-3'))
+
+
+class StatusCacheReadTestCase(unittest.TestCase):
+    def setUp(self):
+        super(StatusCacheReadTestCase, self).setUp()
+        self.conn = mocks.get_connection()
+
+    def tearDown(self):
+        super(StatusCacheReadTestCase, self).tearDown()
+        mocks.cleanup_connection(self.conn)
+
+    def test_read_uses_cached_status(self):
+        table = rethinkdb.table('table1')
+        xid = low_level.create_tx(self.conn)
+        low_level.write(self.conn, xid, table, 'key-1', None, 'data1')
+        low_level.write(self.conn, xid, table, 'key-2', None, 'data2')
+        self.assertTrue(low_level.commit(self.conn, xid, {}))
+        rethinkdb.table('transactions').get(xid).delete().run(self.conn)
+
+        # Intents are still resolved as committed since the transaction
+        # record is never looked up
+        self.assertEqual((xid, 'data1'),
+                         low_level.read(self.conn, table, 'key-1'))
+        self.assertEqual({'key-2': (xid, 'data2')},
+                         low_level.read_many(self.conn, table, ['key-2']))
+        with rethinktx.Transaction(self.conn) as tx:
+            self.assertEqual('data1', tx.table('table1').get('key-1'))
@@ -49,21 +49,21 @@ def perform_work(conn, account_ids):
 
 
 class WorkerThread(threading.Thread):
-    def __init__(self, account_ids):
+    def __init__(self, connect, account_ids):
         super(WorkerThread, self).__init__()
+        self.connect = connect
         self.account_ids = account_ids
 
     def run(self):
-        with mocks.get_connection() as conn:
+        with self.connect() as conn:
             perform_work(conn, self.account_ids)
 
 
 class ConcurrentTransactionsTestCase(unittest.TestCase):
     def setUp(self):
         super(ConcurrentTransactionsTestCase, self).setUp()
-        with mocks.get_connection() as conn:
-            if isinstance(conn, mocks.ConnectionMock):
-                self.skipTest('Mocked connection not supported')
+        self.connect = mocks.connection_factory()
+        with self.connect() as conn:
             self._ensure_provisioned(conn)
             self.account_ids = self._create_accounts(conn, NUM_ACCOUNTS)
 
@@ -93,7 +93,7 @@ class ConcurrentTransactionsTestCase(unittest.TestCase):
         return account_ids
 
     def _total_balance(self):
-        with mocks.get_connection() as conn:
+        with self.connect() as conn:
             total_balance = 0
             with rethinktx.Transaction(conn) as tx:
                 accounts_tbl = tx.table('accounts')
@@ -101,9 +101,8 @@ class ConcurrentTransactionsTestCase(unittest.TestCase):
                     total_balance += accounts_tbl.get(account_id)['balance']
             return total_balance
 
-    @staticmethod
-    def _show_stats():
-        with mocks.get_connection() as conn:
+    def _show_stats(self):
+        with self.connect() as conn:
             num_committed = rethinkdb.table('transactions')\
                 .filter({'status': 'committed'}).count().run(conn)
             num_aborted = rethinkdb.table('transactions')\
@@ -114,7 +113,7 @@ class ConcurrentTransactionsTestCase(unittest.TestCase):
     def test_concurrent_transactions(self):
         workers = []
         for _ in six.moves.range(NUM_THREADS):
-            worker = WorkerThread(self.account_ids)
+            worker = WorkerThread(self.connect, self.account_ids)
             workers.append(worker)
             worker.start()
 
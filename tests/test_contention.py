@@ -0,0 +1,125 @@
+# Copyright 2016, Anton Frolov <frolov.anton@gmail.com>
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+import time
+
+import rethinkdb
+import rethinktx
+from rethinktx import contention
+from . import mocks
+
+import unittest
+
+MAX_WAIT = 0.05
+
+
+class ContentionPolicyTestCase(unittest.TestCase):
+    def setUp(self):
+        super(ContentionPolicyTestCase, self).setUp()
+        self.conn = mocks.get_connection()
+
+    def tearDown(self):
+        super(ContentionPolicyTestCase, self).tearDown()
+        mocks.cleanup_connection(self.conn)
+
+    def _begin(self, policy, key):
+        tx = rethinktx.Transaction(self.conn, contention=policy)
+        tx.table('table1').put(key, 'data')
+        return tx
+
+    def test_wound_wait_older_wounds_younger(self):
+        policy = contention.WoundWait(max_wait=MAX_WAIT)
+        tx1 = self._begin(policy, 'key-1')
+        tx2 = self._begin(policy, 'key-2')
+
+        started = time.time()
+        self.assertIsNone(tx1.table('table1').get('key-2', None))
+        self.assertLess(time.time() - started, MAX_WAIT)
+        tx1.commit()
+        with self.assertRaises(rethinktx.OptimisticLockFailure):
+            tx2.commit()
+
+    def test_wound_wait_younger_waits_for_older(self):
+        policy = contention.WoundWait(max_wait=MAX_WAIT)
+        tx1 = self._begin(policy, 'key-1')
+        tx2 = self._begin(policy, 'key-2')
+
+        started = time.time()
+        self.assertIsNone(tx2.table('table1').get('key-1', None))
+        self.assertGreaterEqual(time.time() - started, MAX_WAIT)
+        tx2.commit()
+        with self.assertRaises(rethinktx.OptimisticLockFailure):
+            tx1.commit()
+
+    def test_wait_die_younger_dies(self):
+        policy = contention.WaitDie(max_wait=MAX_WAIT)
+        tx1 = self._begin(policy, 'key-1')
+        tx2 = self._begin(policy, 'key-2')
+
+        with self.assertRaises(rethinktx.OptimisticLockFailure) as ctx:
+            tx2.table('table1').get_many(['key-1'])
+        self.assertEqual((tx2.xid,), ctx.exception.args)
+        tx2.abort()
+        tx1.commit()
+
+    def test_wait_policy_waits_then_aborts(self):
+        policy = contention.WaitPolicy(max_wait=MAX_WAIT)
+        tx1 = self._begin(policy, 'key-1')
+        tx2 = self._begin(policy, 'key-2')
+
+        started = time.time()
+        self.assertIsNone(tx1.table('table1').get('key-2', None))
+        self.assertGreaterEqual(time.time() - started, MAX_WAIT)
+        tx1.commit()
+        with self.assertRaises(rethinktx.OptimisticLockFailure):
+            tx2.commit()
+
+    def test_wait_die_reader_without_writes_waits(self):
+        policy = contention.WaitDie(max_wait=MAX_WAIT)
+        tx1 = self._begin(policy, 'key-1')
+
+        with rethinktx.Transaction(self.conn, contention=policy) as tx2:
+            self.assertIsNone(tx2.table('table1').get('key-1', None))
+        with self.assertRaises(rethinktx.OptimisticLockFailure):
+            tx1.commit()
+
+    def test_priority_taken_at_construction(self):
+        policy = contention.WoundWait(max_wait=MAX_WAIT)
+        tx1 = rethinktx.Transaction(self.conn, contention=policy)
+        tx2 = self._begin(policy, 'key-2')
+        tx1.table('table1').put('key-1', 'data')
+
+        started = time.time()
+        self.assertIsNone(tx1.table('table1').get('key-2', None))
+        self.assertLess(time.time() - started, MAX_WAIT)
+        tx1.commit()
+        with self.assertRaises(rethinktx.OptimisticLockFailure):
+            tx2.commit()
+
+    def test_retry_keeps_priority(self):
+        priorities = []
+
+        def fn(tx):
+            tx.table('table1').put('key-1', 'data')
+            record = rethinkdb.table('transactions').get(tx.xid).run(
+                self.conn)
+            priorities.append((tx.priority, record['priority']))
+            if len(priorities) == 1:
+                raise rethinktx.OptimisticLockFailure(tx.xid)
+
+        rethinktx.run_in_transaction(
+            fn, self.conn, backoff=rethinktx.ExponentialBackoff(initial=0),
+            contention=contention.WoundWait())
+        self.assertEqual(2, len(priorities))
+        self.assertEqual(priorities[0], priorities[1])
+        self.assertEqual(priorities[0][0], priorities[0][1])
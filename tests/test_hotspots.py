@@ -0,0 +1,90 @@
+# Copyright 2016, Anton Frolov <frolov.anton@gmail.com>
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+import rethinktx
+from rethinktx import hotspots
+from . import mocks
+
+import unittest
+
+
+class SpaceSavingTestCase(unittest.TestCase):
+    def test_heavy_hitters_survive_eviction(self):
+        sketch = hotspots.SpaceSaving(capacity=3)
+        for i in range(100):
+            sketch.add('hot')
+            sketch.add('cold-%d' % i)
+        self.assertEqual(3, len(sketch))
+        item, count, error = sketch.top(1)[0]
+        self.assertEqual(('hot', 100, 0), (item, count, error))
+
+    def test_eviction_takes_least_counted(self):
+        sketch = hotspots.SpaceSaving(capacity=2)
+        for item in ('a', 'a', 'b', 'c', 'c', 'd'):
+            sketch.add(item)
+        self.assertEqual([('c', 3, 1), ('d', 3, 2)],
+                         sorted(sketch.top(2)))
+
+
+class HotspotTrackerTestCase(unittest.TestCase):
+    def setUp(self):
+        super(HotspotTrackerTestCase, self).setUp()
+        self.conn = mocks.get_connection()
+        self.tracker = hotspots.HotspotTracker()
+        hotspots.set_tracker(self.tracker)
+
+    def tearDown(self):
+        super(HotspotTrackerTestCase, self).tearDown()
+        hotspots.set_tracker(None)
+        mocks.cleanup_connection(self.conn)
+
+    def test_records_conflicts(self):
+        with rethinktx.Transaction(self.conn) as tx:
+            tx.table('table1').put('key-1', 'data1')
+            tx.table('table1').put('key-2', 'data2')
+
+        for _ in range(2):
+            with rethinktx.Transaction(self.conn) as tx1, \
+                    rethinktx.Transaction(self.conn) as tx2:
+                tx1.table('table1').put('key-1', 'modified data1')
+                tx2.table('table1').get_many(['key-1', 'key-2'])
+                with self.assertRaises(rethinktx.OptimisticLockFailure):
+                    tx1.commit()
+
+        top = self.tracker.snapshot(k=1)
+        self.assertEqual(1, len(top))
+        self.assertEqual(('table1', 'key-1', 4),
+                         (top[0]['table'], top[0]['key'],
+                          top[0]['conflicts']))
+        self.assertGreater(top[0]['rate'], 0)
+        self.assertEqual({'intent': 2, 'commit': 2}, self.tracker.kinds)
+
+    def test_records_buffered_write_conflicts(self):
+        with rethinktx.Transaction(self.conn) as tx:
+            tx.table('table1').put('key-1', 'data1')
+            tx.table('table1').put('key-2', 'data2')
+
+        tx1 = rethinktx.Transaction(self.conn, buffered=True)
+        tx1.table('table1').put('key-1', 'modified data1')
+        tx1.table('table1').put('key-2', 'modified data2')
+        with rethinktx.Transaction(self.conn) as tx2:
+            tx2.table('table1').put('key-2', 'concurrent data2')
+        with self.assertRaises(rethinktx.OptimisticLockFailure) as ctx:
+            tx1.commit()
+
+        self.assertEqual(['key-2'], ctx.exception.args[1])
+        self.assertEqual([('table1', 'key-2', 1)],
+                         [(hotspot['table'], hotspot['key'],
+                           hotspot['conflicts'])
+                          for hotspot in self.tracker.snapshot()])
+        self.assertEqual({'write': 1}, self.tracker.kinds)
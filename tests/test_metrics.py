@@ -0,0 +1,70 @@
+# Copyright 2016, Anton Frolov <frolov.anton@gmail.com>
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+import rethinktx
+from rethinktx import metrics
+from . import mocks
+
+import unittest
+
+
+class HistogramTestCase(unittest.TestCase):
+    def test_percentiles(self):
+        histogram = metrics.Histogram(metrics.COUNT_BOUNDS)
+        for value in range(1, 101):
+            histogram.add(value)
+        self.assertEqual(100, histogram.count)
+        self.assertEqual(64, histogram.percentile(50))
+        self.assertEqual(100, histogram.percentile(99))
+        self.assertEqual(0, metrics.Histogram().percentile(50))
+
+
+class HistogramCollectorTestCase(unittest.TestCase):
+    def setUp(self):
+        super(HistogramCollectorTestCase, self).setUp()
+        self.conn = mocks.get_connection()
+        self.collector = metrics.HistogramCollector()
+        metrics.set_observer(self.collector)
+
+    def tearDown(self):
+        super(HistogramCollectorTestCase, self).tearDown()
+        metrics.set_observer(None)
+        mocks.cleanup_connection(self.conn)
+
+    def test_collects_transaction_metrics(self):
+        with rethinktx.Transaction(self.conn) as tx:
+            tx.table('table1').put('key-1', 'data1')
+
+        with rethinktx.Transaction(self.conn) as tx1, \
+                rethinktx.Transaction(self.conn) as tx2:
+            tx1.table('table1').put('key-1', 'modified data1')
+            self.assertEqual('data1', tx2.table('table1').get('key-1'))
+            with self.assertRaises(rethinktx.OptimisticLockFailure):
+                tx1.commit()
+
+        snapshot = self.collector.snapshot()
+        for operation in ('create_tx', 'read', 'write', 'commit', 'abort',
+                          'clear'):
+            self.assertGreater(snapshot['operations'][operation]['count'], 0)
+        self.assertEqual(2, snapshot['transactions']['committed']['count'])
+        self.assertEqual(1, snapshot['transactions']['aborted']['count'])
+        self.assertEqual(3, snapshot['round_trips']['count'])
+        self.assertEqual(1, snapshot['intents']['pending'])
+        self.assertEqual(1, snapshot['lock_failures']['commit'])
+
+    def test_null_observer(self):
+        metrics.set_observer(None)
+        self.assertIs(metrics.NULL, metrics.get_observer())
+        with rethinktx.Transaction(self.conn) as tx:
+            tx.table('table1').put('key-1', 'data1')
+        self.assertEqual({}, self.collector.snapshot()['operations'])
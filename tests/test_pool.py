@@ -0,0 +1,82 @@
+# Copyright 2016, Anton Frolov <frolov.anton@gmail.com>
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+import rethinkdb
+import rethinktx
+from . import mocks
+
+import unittest
+
+
+class ConnectionPoolTestCase(unittest.TestCase):
+    def setUp(self):
+        super(ConnectionPoolTestCase, self).setUp()
+        self.conn = mocks.get_connection()
+        self.connections = []
+        self.pool = rethinktx.ConnectionPool(size=2, connect=self._connect,
+                                             timeout=0.01)
+
+    def tearDown(self):
+        super(ConnectionPoolTestCase, self).tearDown()
+        self.pool.close()
+        mocks.cleanup_connection(self.conn)
+
+    def _connect(self):
+        conn = mocks.connect_like(self.conn)
+        self.connections.append(conn)
+        return conn
+
+    def test_transactions_reuse_connection(self):
+        with rethinktx.Transaction(pool=self.pool) as tx:
+            tx.table('table1').put('key', 'data')
+        with rethinktx.Transaction(pool=self.pool) as tx:
+            self.assertEqual('data', tx.table('table1').get('key'))
+        self.assertEqual(1, len(self.connections))
+
+    def test_connection_released_on_exception(self):
+        with self.assertRaises(rethinktx.NotFound):
+            with rethinktx.Transaction(pool=self.pool) as tx:
+                tx.table('table1').get('key')
+        self.assertEqual(rethinktx.transaction.STATE_ABORTED, tx.state)
+        with self.pool.connection() as conn1, \
+                self.pool.connection() as conn2:
+            self.assertIsNot(conn1, conn2)
+
+    def test_broken_connection_discarded(self):
+        with self.assertRaises(rethinkdb.ReqlDriverError):
+            with self.pool.connection():
+                raise rethinkdb.ReqlDriverError('connection lost')
+        with self.pool.connection():
+            pass
+        self.assertEqual(2, len(self.connections))
+
+    def test_dead_idle_connection_replaced(self):
+        pool = rethinktx.ConnectionPool(size=1, connect=self._connect,
+                                        probe_idle=0)
+        with pool.connection() as conn1:
+            pass
+
+        def fail(*args, **kwargs):
+            raise rethinkdb.ReqlDriverError('Connection reset by peer')
+
+        conn1._start = fail
+        conn1.reconnect = fail
+        with pool.connection() as conn2:
+            self.assertIsNot(conn1, conn2)
+        self.assertEqual(2, len(self.connections))
+        pool.close()
+
+    def test_pool_exhausted(self):
+        with self.pool.connection(), self.pool.connection():
+            with self.assertRaises(rethinktx.DatabaseException):
+                self.pool.acquire()
@@ -0,0 +1,69 @@
+# Copyright 2016, Anton Frolov <frolov.anton@gmail.com>
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+import rethinkdb
+import rethinktx
+from rethinktx import recovery
+from . import mocks
+
+import unittest
+
+
+class RecoveryTestCase(unittest.TestCase):
+    def setUp(self):
+        super(RecoveryTestCase, self).setUp()
+        self.conn = mocks.get_connection()
+        recovery.provision(self.conn, ['table1'])
+        self.table = rethinkdb.table('table1')
+
+    def tearDown(self):
+        super(RecoveryTestCase, self).tearDown()
+        mocks.cleanup_connection(self.conn)
+
+    def _record(self, key):
+        return self.table.get(key).run(self.conn)
+
+    def _tx_status(self, xid):
+        return rethinkdb.table('transactions').get(xid).run(
+            self.conn)['status']
+
+    def test_recover(self):
+        resolver = rethinktx.IntentResolver(lambda: self.conn, num_workers=0)
+        with rethinktx.Transaction(self.conn, resolver=resolver) as tx1:
+            tx1.table('table1').put('key-1', 'data1')
+        resolver.shutdown()
+        # Transaction of crashed client which will never finish
+        tx2 = rethinktx.Transaction(self.conn)
+        tx2.table('table1').put('key-2', 'data2')
+        tx2.table('table1').put('key-3', 'data3')
+
+        self.assertEqual(1, recovery.recover(self.conn, self.table,
+                                             timeout=3600, batch_size=1))
+        self.assertEqual('pending', self._tx_status(tx2.xid))
+        self.assertEqual('data1', self._record('key-1')['value'])
+
+        self.assertEqual(2, recovery.recover(self.conn, self.table,
+                                             timeout=0, batch_size=1))
+        self.assertEqual('aborted', self._tx_status(tx2.xid))
+        for key in ('key-1', 'key-2', 'key-3'):
+            self.assertIsNone(self._record(key)['intent'])
+        self.assertNotIn('value', self._record('key-2'))
+
+    def test_daemon(self):
+        tx = rethinktx.Transaction(self.conn)
+        tx.table('table1').put('key-1', 'data1')
+
+        daemon = recovery.RecoveryDaemon(self.conn, ['table1'], timeout=0)
+        self.assertEqual(1, daemon.run_once())
+        self.assertEqual(0, daemon.run_once())
+        self.assertEqual(1, daemon.resolved)
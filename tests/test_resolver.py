@@ -0,0 +1,136 @@
+# Copyright 2016, Anton Frolov <frolov.anton@gmail.com>
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+import rethinkdb
+import rethinktx
+from . import mocks
+
+import unittest
+
+
+class IntentResolverTestCase(unittest.TestCase):
+    def setUp(self):
+        super(IntentResolverTestCase, self).setUp()
+        self.conn = mocks.get_connection()
+        self.resolver = rethinktx.IntentResolver(self._connect, num_workers=1)
+
+    def tearDown(self):
+        super(IntentResolverTestCase, self).tearDown()
+        self.resolver.shutdown()
+        mocks.cleanup_connection(self.conn)
+
+    def _connect(self):
+        if isinstance(self.conn, mocks.ConnectionMock):
+            return self.conn
+        return mocks.get_connection()
+
+    def _record(self, key):
+        return rethinkdb.table('table1').get(key).run(self.conn)
+
+    def test_commit_clears_in_background(self):
+        with rethinktx.Transaction(self.conn, resolver=self.resolver) as tx:
+            tx.table('table1').put('key-1', 'data1')
+            tx.table('table1').put('key-2', 'data2')
+        self.resolver.flush()
+
+        for key, value in (('key-1', 'data1'), ('key-2', 'data2')):
+            record = self._record(key)
+            self.assertIsNone(record['intent'])
+            self.assertEqual(value, record['value'])
+
+    def test_committed_intents_readable_before_flush(self):
+        self.resolver.shutdown()
+        resolver = rethinktx.IntentResolver(self._connect, num_workers=0)
+        with rethinktx.Transaction(self.conn, resolver=resolver) as tx:
+            tx.table('table1').put('key-1', 'data1')
+
+        self.assertEqual('data1', self._record('key-1')['intent'])
+        with rethinktx.Transaction(self.conn) as tx:
+            self.assertEqual('data1', tx.table('table1').get('key-1'))
+        resolver.shutdown()
+
+    def test_deferred_write_back(self):
+        self.resolver.shutdown()
+        resolver = rethinktx.IntentResolver(self._connect, num_workers=0)
+        with rethinktx.Transaction(self.conn, resolver=resolver) as tx:
+            tx.table('table1').put('key-1', 'data1')
+            tx.table('table1').put('key-2', 'data2')
+
+        with rethinktx.Transaction(self.conn, resolver=resolver,
+                                   defer_write_back=True) as tx:
+            self.assertEqual('data1', tx.table('table1').get('key-1'))
+            self.assertEqual('data2', tx.table('table1').get('key-2'))
+            self.assertEqual('data1', self._record('key-1')['intent'])
+            # Both keys of the same transaction are written back by one task
+            self.assertEqual(2, resolver._queue.qsize())
+            tx.table('table1').put('key-1', 'modified data1')
+            tx.abort()
+
+        self.assertEqual('data1', self._record('key-1')['value'])
+        with rethinktx.Transaction(self.conn) as tx:
+            self.assertEqual('data1', tx.table('table1').get('key-1'))
+        resolver.shutdown()
+
+    def test_deferred_write_back_after_shutdown(self):
+        self.resolver.shutdown()
+        resolver = rethinktx.IntentResolver(self._connect, num_workers=0)
+        with rethinktx.Transaction(self.conn, resolver=resolver) as tx:
+            tx.table('table1').put('key-1', 'data1')
+        resolver.shutdown()
+
+        with rethinktx.Transaction(self.conn, resolver=resolver,
+                                   defer_write_back=True) as tx:
+            self.assertEqual('data1', tx.table('table1').get('key-1'))
+        record = self._record('key-1')
+        self.assertIsNone(record['intent'])
+        self.assertEqual('data1', record['value'])
+
+    def test_deferred_write_back_requires_resolver(self):
+        with self.assertRaises(ValueError):
+            rethinktx.Transaction(self.conn, defer_write_back=True)
+
+    def test_submit_after_shutdown_fails(self):
+        self.resolver.shutdown()
+        with self.assertRaises(RuntimeError):
+            self.resolver.submit('xid', True, {'table1': {'key'}})
+
+    def test_commit_after_shutdown_clears_intents(self):
+        self.resolver.shutdown()
+        with rethinktx.Transaction(self.conn, resolver=self.resolver) as tx:
+            tx.table('table1').put('key-1', 'data1')
+
+        self.assertEqual('committed', tx.state)
+        record = self._record('key-1')
+        self.assertIsNone(record['intent'])
+        self.assertEqual('data1', record['value'])
+
+    def test_worker_reconnects(self):
+        self.resolver.shutdown()
+        attempts = []
+
+        def connect():
+            attempts.append(None)
+            if len(attempts) == 1:
+                raise rethinkdb.ReqlDriverError('Could not connect')
+            return self._connect()
+
+        resolver = rethinktx.IntentResolver(connect, num_workers=1)
+        for key in ('key-1', 'key-2'):
+            with rethinktx.Transaction(self.conn, resolver=resolver) as tx:
+                tx.table('table1').put(key, 'data')
+            resolver.flush()
+        resolver.shutdown()
+
+        self.assertEqual(2, len(attempts))
+        self.assertEqual('data', self._record('key-1')['intent'])
+        self.assertIsNone(self._record('key-2')['intent'])
@@ -0,0 +1,69 @@
+# Copyright 2016, Anton Frolov <frolov.anton@gmail.com>
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+import rethinktx
+from rethinktx import retry
+from . import mocks
+
+import unittest
+
+NO_BACKOFF = rethinktx.ExponentialBackoff(initial=0, jitter=False)
+
+
+class RetryTestCase(unittest.TestCase):
+    def setUp(self):
+        super(RetryTestCase, self).setUp()
+        self.conn = mocks.get_connection()
+        self.stats = retry.RetryStats()
+
+    def tearDown(self):
+        super(RetryTestCase, self).tearDown()
+        mocks.cleanup_connection(self.conn)
+
+    def test_retries_until_committed(self):
+        attempts = []
+
+        def work(tx):
+            attempts.append(tx)
+            tx.table('table1').put('key', len(attempts))
+            if len(attempts) < 3:
+                raise rethinktx.OptimisticLockFailure(tx.xid)
+            return 'done'
+
+        self.assertEqual('done', rethinktx.run_in_transaction(
+            work, self.conn, backoff=NO_BACKOFF, retry_stats=self.stats))
+        stats = self.stats.snapshot()
+        self.assertEqual(3, stats['attempts'])
+        self.assertEqual(2, stats['aborts'])
+        self.assertEqual(1, stats['commits'])
+
+        with rethinktx.Transaction(self.conn) as tx:
+            self.assertEqual(3, tx.table('table1').get('key'))
+
+    def test_gives_up_after_max_attempts(self):
+        @rethinktx.transactional(self.conn, max_attempts=2,
+                                 backoff=NO_BACKOFF, retry_stats=self.stats)
+        def work(tx):
+            raise rethinktx.OptimisticLockFailure(tx.xid)
+
+        with self.assertRaises(rethinktx.OptimisticLockFailure):
+            work()
+        self.assertEqual(2, self.stats.attempts)
+        self.assertEqual(1, self.stats.failures)
+
+    def test_backoff_bounds(self):
+        backoff = rethinktx.ExponentialBackoff(initial=0.1, maximum=0.3)
+        self.assertTrue(0 <= backoff.delay(1) <= 0.1)
+        self.assertTrue(0 <= backoff.delay(10) <= 0.3)
+        backoff.jitter = False
+        self.assertEqual(0.2, backoff.delay(2))
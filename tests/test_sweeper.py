@@ -0,0 +1,84 @@
+# Copyright 2016, Anton Frolov <frolov.anton@gmail.com>
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+import rethinkdb
+import rethinktx
+from rethinktx import low_level
+from rethinktx import recovery
+from rethinktx import sweeper
+from . import mocks
+
+import unittest
+
+
+class SweeperTestCase(unittest.TestCase):
+    def setUp(self):
+        super(SweeperTestCase, self).setUp()
+        self.conn = mocks.get_connection()
+        recovery.provision(self.conn, [])
+
+    def tearDown(self):
+        super(SweeperTestCase, self).tearDown()
+        mocks.cleanup_connection(self.conn)
+
+    def _tx_record(self, xid):
+        return rethinkdb.table('transactions').get(xid).run(self.conn)
+
+    def test_sweep_finished_transactions(self):
+        # Resolver without workers leaves committed intents in place
+        resolver = rethinktx.IntentResolver(lambda: self.conn, num_workers=0)
+        with rethinktx.Transaction(self.conn, resolver=resolver) as tx1:
+            tx1.table('table1').put('key-1', 'data1')
+        resolver.shutdown()
+        tx2 = rethinktx.Transaction(self.conn)
+        tx2.table('table1').put('key-2', 'data2')
+        tx2.abort()
+        tx3 = rethinktx.Transaction(self.conn)
+        tx3.table('table1').put('key-3', 'data3')
+
+        self.assertEqual(0, sweeper.sweep(self.conn, retention=3600))
+        self.assertEqual(2, sweeper.sweep(self.conn, retention=0))
+
+        self.assertIsNone(self._tx_record(tx1.xid))
+        self.assertIsNone(self._tx_record(tx2.xid))
+        self.assertIsNotNone(self._tx_record(tx3.xid))
+        record = rethinkdb.table('table1').get('key-1').run(self.conn)
+        self.assertIsNone(record['intent'])
+        self.assertEqual('data1', record['value'])
+
+    def test_sweep_writesets(self):
+        resolver = rethinktx.IntentResolver(lambda: self.conn, num_workers=0)
+        with rethinktx.Transaction(self.conn, resolver=resolver) as tx:
+            tx.table('table1').bulk_put([('key-1', 'data1'),
+                                         ('key-2', 'data2')], chunk_size=1)
+        resolver.shutdown()
+
+        self.assertEqual(1, sweeper.sweep(self.conn, retention=0))
+        for key, value in (('key-1', 'data1'), ('key-2', 'data2')):
+            record = rethinkdb.table('table1').get(key).run(self.conn)
+            self.assertIsNone(record['intent'])
+            self.assertEqual(value, record['value'])
+        writesets = rethinkdb.table('transaction_writesets').get_all(
+            *low_level.writeset_ids(tx.xid, 2)).run(self.conn)
+        self.assertEqual([], list(writesets))
+
+    def test_sweeper_batches(self):
+        for i in range(3):
+            with rethinktx.Transaction(self.conn) as tx:
+                tx.table('table1').put('key-%d' % i, 'data')
+
+        worker = sweeper.Sweeper(self.conn, retention=0, batch_size=2,
+                                 interval=5)
+        self.assertEqual((2, 0), worker.run_once())
+        self.assertEqual((1, 5), worker.run_once())
+        self.assertEqual(3, worker.deleted)
@@ -11,7 +11,10 @@
 #    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
 #    License for the specific language governing permissions and limitations
 #    under the License.
+import rethinkdb
 import rethinktx
+from rethinktx import codec
+from rethinktx import low_level
 from . import mocks
 
 import unittest
@@ -101,3 +104,336 @@ class TransactionTestCase(unittest.TestCase):
             with self.assertRaises(rethinktx.OptimisticLockFailure):
                 tx2.table('table1').put('key-1', 'what a failure')
                 tx2.abort()
+
+    def test_get_many(self):
+        with rethinktx.Transaction(self.conn) as tx:
+            tx.table('table1').put('key-1', 'data1')
+            tx.table('table1').put('key-2', 'data2')
+
+        with rethinktx.Transaction(self.conn) as tx:
+            self.assertEqual({'key-1': 'data1', 'key-2': 'data2'},
+                             tx.table('table1').get_many(['key-1', 'key-2']))
+
+    def test_get_many_non_existent(self):
+        with rethinktx.Transaction(self.conn) as tx:
+            tx.table('table1').put('key-1', 'data1')
+
+        with rethinktx.Transaction(self.conn) as tx:
+            table = tx.table('table1')
+            self.assertEqual({'key-1': 'data1', 'key-2': None},
+                             table.get_many(['key-1', 'key-2'], None))
+            with self.assertRaises(rethinktx.NotFound):
+                table.get_many(['key-1', 'key-2'])
+
+    def test_get_many_resolves_intents(self):
+        with rethinktx.Transaction(self.conn) as tx:
+            tx.table('table1').put('key-1', 'data1')
+            tx.table('table1').put('key-2', 'data2')
+
+        with rethinktx.Transaction(self.conn) as tx1, \
+                rethinktx.Transaction(self.conn) as tx2:
+            tx1.table('table1').put('key-1', 'modified data1')
+            self.assertEqual({'key-1': 'data1', 'key-2': 'data2'},
+                             tx2.table('table1').get_many(['key-1', 'key-2']))
+            with self.assertRaises(rethinktx.OptimisticLockFailure):
+                tx1.commit()
+
+    def test_abort_clears_intents(self):
+        with rethinktx.Transaction(self.conn) as tx:
+            tx.table('table1').put('key-1', 'data1')
+
+        tx = rethinktx.Transaction(self.conn)
+        tx.table('table1').put('key-1', 'modified data1')
+        tx.table('table1').put('key-2', 'data2')
+        tx.abort()
+
+        for key in ('key-1', 'key-2'):
+            record = rethinkdb.table('table1').get(key).run(self.conn)
+            self.assertIsNone(record['intent'])
+        with rethinktx.Transaction(self.conn) as tx:
+            self.assertEqual('data1', tx.table('table1').get('key-1'))
+
+    def test_buffered_put_get(self):
+        with rethinktx.Transaction(self.conn, buffered=True) as tx:
+            tx.table('table1').put('key-1', 'data1')
+            tx.table('table1').put('key-1', 'modified data1')
+            tx.table('table1').put('key-2', 'data2')
+            self.assertIsNone(
+                rethinkdb.table('table1').get('key-1').run(self.conn))
+
+        with rethinktx.Transaction(self.conn) as tx:
+            self.assertEqual('modified data1', tx.table('table1').get('key-1'))
+            self.assertEqual('data2', tx.table('table1').get('key-2'))
+
+    def test_buffered_write_conflict(self):
+        with rethinktx.Transaction(self.conn) as tx:
+            tx.table('table1').put('key-1', 'data1')
+
+        with rethinktx.Transaction(self.conn, buffered=True) as tx1, \
+                rethinktx.Transaction(self.conn) as tx2:
+            tx1.table('table1').put('key-1', 'modified data1')
+            tx1.table('table1').put('key-2', 'data2')
+            tx2.table('table1').put('key-1', 'data2')
+            tx2.commit()
+            with self.assertRaises(rethinktx.OptimisticLockFailure):
+                tx1.commit()
+
+        with rethinktx.Transaction(self.conn) as tx:
+            self.assertEqual('data2', tx.table('table1').get('key-1'))
+            with self.assertRaises(rethinktx.NotFound):
+                tx.table('table1').get('key-2')
+
+    def test_readonly(self):
+        with rethinktx.Transaction(self.conn) as tx:
+            tx.table('table1').put('key-1', 'data1')
+
+        with rethinktx.Transaction(self.conn, readonly=True) as tx:
+            self.assertIsNone(tx.xid)
+            self.assertEqual('data1', tx.table('table1').get('key-1'))
+            with self.assertRaises(RuntimeError):
+                tx.table('table1').put('key-2', 'data2')
+        self.assertEqual(rethinktx.transaction.STATE_COMMITTED, tx.state)
+
+        with rethinktx.Transaction(self.conn) as tx:
+            with self.assertRaises(rethinktx.NotFound):
+                tx.table('table1').get('key-2')
+
+    def test_record_created_on_first_write(self):
+        with rethinktx.Transaction(self.conn) as tx:
+            tx.table('table1').put('key-1', 'data1')
+            xid = tx.xid
+            self.assertIsNotNone(xid)
+
+        with rethinktx.Transaction(self.conn) as tx:
+            self.assertEqual('data1', tx.table('table1').get('key-1'))
+            self.assertIsNone(tx.xid)
+        self.assertIsNone(tx.xid)
+        self.assertEqual(rethinktx.transaction.STATE_COMMITTED, tx.state)
+
+        record = rethinkdb.table('transactions').get(xid).run(self.conn)
+        self.assertEqual('committed', record['status'])
+
+    def test_read_resolves_intents(self):
+        table = rethinkdb.table('table1')
+        committed = low_level.create_tx(self.conn)
+        low_level.write(self.conn, committed, table, 'key-1', None, 'data1')
+        self.assertTrue(low_level.commit(self.conn, committed, {}))
+        pending = low_level.create_tx(self.conn)
+        low_level.write(self.conn, pending, table, 'key-2', None, 'data2')
+
+        self.assertEqual((committed, 'data1'),
+                         low_level.read(self.conn, table, 'key-1'))
+        self.assertEqual((pending, None),
+                         low_level.read(self.conn, table, 'key-2'))
+        for key in ('key-1', 'key-2'):
+            self.assertIsNone(table.get(key).run(self.conn)['intent'])
+        tx = rethinkdb.table('transactions').get(pending).run(self.conn)
+        self.assertEqual('aborted', tx['status'])
+
+    def test_pipelined_write_conflict(self):
+        with rethinktx.Transaction(self.conn) as tx:
+            tx.table('table1').put('key-1', 'data1')
+            tx.table('table1').put('key-2', 'data2')
+
+        with rethinktx.Transaction(self.conn, pipelined=True) as tx1, \
+                rethinktx.Transaction(self.conn) as tx2:
+            tx1.table('table1').put('key-1', 'modified data1')
+            tx1.table('table1').put('key-2', 'modified data2')
+            tx1.table('table1').put('key-3', 'data3')
+            tx2.table('table1').put('key-2', 'data2 by tx2')
+            tx2.commit()
+            with self.assertRaises(rethinktx.OptimisticLockFailure) as ctx:
+                tx1.commit()
+            self.assertEqual(['key-2'], ctx.exception.args[1])
+
+        with rethinktx.Transaction(self.conn, pipelined=True) as tx:
+            self.assertEqual('data1', tx.table('table1').get('key-1'))
+            self.assertEqual('data2 by tx2', tx.table('table1').get('key-2'))
+            with self.assertRaises(rethinktx.NotFound):
+                tx.table('table1').get('key-3')
+            tx.table('table1').put('key-3', 'data3')
+
+        record = rethinkdb.table('table1').get('key-3').run(self.conn)
+        self.assertIsNone(record['intent'])
+        self.assertEqual('data3', record['value'])
+
+    def test_put_replaces_nested_fields(self):
+        resolver = rethinktx.IntentResolver(lambda: self.conn, num_workers=0)
+        with rethinktx.Transaction(self.conn, resolver=resolver) as tx:
+            tx.table('table1').put('key-1', {'a': 1, 'b': {'c': 2, 'd': 3}})
+        resolver.shutdown()
+
+        with rethinktx.Transaction(self.conn) as tx:
+            tx.table('table1').put('key-1', {'b': {'c': 4}})
+            tx.table('table1').put('key-1', {'b': {'e': 5}})
+        with rethinktx.Transaction(self.conn) as tx:
+            tx.table('table1').put('key-1', {'f': 6})
+
+        record = rethinkdb.table('table1').get('key-1').run(self.conn)
+        self.assertEqual({'f': 6}, record['value'])
+
+    def test_bulk_put(self):
+        with rethinktx.Transaction(self.conn) as tx:
+            tx.table('table1').put('key-0', 'data0')
+
+        with rethinktx.Transaction(self.conn, buffered=True) as tx:
+            table = tx.table('table1')
+            table.put('key-1', 'buffered data1')
+            table.bulk_put((('key-%d' % i, 'data%d' % i)
+                            for i in range(10)), chunk_size=4)
+            self.assertEqual(3, tx.writesets)
+            self.assertNotIn('key-5', tx.session['table1'])
+            self.assertEqual('data1', table.get('key-1'))
+            self.assertEqual('data5', table.get('key-5'))
+            table.put('key-5', 'modified data5')
+            xid = tx.xid
+
+        record = rethinkdb.table('transactions').get(xid).run(self.conn)
+        self.assertEqual(3, record['writesets'])
+        self.assertEqual({'key-1', 'key-5'},
+                         set(record['changes']['table1']))
+        for i in range(10):
+            self.assertIsNone(rethinkdb.table('table1').get(
+                'key-%d' % i).run(self.conn)['intent'])
+        with rethinktx.Transaction(self.conn) as tx:
+            self.assertEqual({'key-0': 'data0', 'key-5': 'modified data5',
+                              'key-9': 'data9'},
+                             tx.table('table1').get_many(
+                                 ['key-0', 'key-5', 'key-9']))
+
+    def test_bulk_put_abort(self):
+        with rethinktx.Transaction(self.conn) as tx:
+            tx.table('table1').bulk_put([('key-1', 'data1')])
+            tx.abort()
+
+        record = rethinkdb.table('table1').get('key-1').run(self.conn)
+        self.assertIsNone(record['intent'])
+        self.assertNotIn('value', record)
+
+    def test_delta_update(self):
+        with rethinktx.Transaction(self.conn) as tx:
+            tx.table('table1').put('key-1', {'a': 1, 'b': {'c': 2}})
+
+        with rethinktx.Transaction(self.conn, delta=True) as tx:
+            table = tx.table('table1')
+            table.update('key-1', {'a': 2})
+            table.update('key-1', {'b': {'d': 3}})
+            vd = tx._lookup('table1', 'key-1')
+            self.assertEqual(2, len(vd.patches))
+            record = rethinkdb.table('table1').get('key-1').run(self.conn)
+            self.assertEqual({'a': 2, 'b': {'d': 3}}, record['intent'])
+            self.assertEqual({'a': 2, 'b': {'d': 3}}, table.get('key-1'))
+            self.assertEqual((), vd.patches)
+            with self.assertRaises(rethinktx.NotFound):
+                table.update('key-2', {'a': 1})
+
+        with rethinktx.Transaction(self.conn) as tx:
+            self.assertEqual({'a': 2, 'b': {'d': 3}},
+                             tx.table('table1').get('key-1'))
+
+    def test_codec(self):
+        with rethinktx.Transaction(self.conn) as tx:
+            tx.table('table1').put('key-1', {'a': 1})
+
+        codecs = {'table1': codec.Zlib()}
+        with rethinktx.Transaction(self.conn, codecs=codecs,
+                                   delta=True) as tx:
+            table = tx.table('table1')
+            self.assertEqual({'a': 1}, table.get('key-1'))
+            table.update('key-1', {'b': 2})
+            table.put('key-2', {'c': 3})
+            tx.table('table2').put('key-1', {'d': 4})
+
+        record = rethinkdb.table('table1').get('key-1').run(self.conn)
+        self.assertEqual('zlib', record['value']['$codec'])
+        self.assertIsNone(record['intent'])
+        self.assertEqual({'d': 4}, rethinkdb.table('table2').get(
+            'key-1').run(self.conn)['value'])
+
+        with rethinktx.Transaction(self.conn, codecs=codecs,
+                                   buffered=True) as tx:
+            table = tx.table('table1')
+            self.assertEqual({'key-1': {'a': 1, 'b': 2}, 'key-2': {'c': 3}},
+                             table.get_many(['key-1', 'key-2']))
+            table.put('key-2', {'c': 4})
+
+        with rethinktx.Transaction(self.conn, codecs=codecs) as tx:
+            self.assertEqual({'c': 4}, tx.table('table1').get('key-2'))
+
+    def test_codec_leaves_untagged_values(self):
+        with rethinktx.Transaction(self.conn) as tx:
+            tx.table('table1').put('key-1', b'raw')
+            tx.table('table1').put('key-2', {'data': 'raw'})
+
+        codecs = {'table1': codec.Zlib()}
+        with rethinktx.Transaction(self.conn, codecs=codecs) as tx:
+            self.assertEqual(
+                {'key-1': b'raw', 'key-2': {'data': 'raw'}},
+                tx.table('table1').get_many(['key-1', 'key-2']))
+
+    def test_scan(self):
+        with rethinktx.Transaction(self.conn) as tx:
+            for i in range(5):
+                tx.table('table1').put('key-%d' % i, {'n': i})
+        table = rethinkdb.table('table1')
+        committed = low_level.create_tx(self.conn)
+        low_level.write(self.conn, committed, table, 'key-1', tx.xid,
+                        {'n': 10})
+        self.assertTrue(low_level.commit(self.conn, committed, {}))
+        pending = low_level.create_tx(self.conn)
+        low_level.write(self.conn, pending, table, 'key-2', tx.xid,
+                        {'n': 20})
+        low_level.write(self.conn, pending, table, 'key-5', None, {'n': 50})
+
+        with rethinktx.Transaction(self.conn) as tx:
+            table = tx.table('table1')
+            table.put('key-3', {'n': 30})
+            self.assertEqual({'key-0': {'n': 0}, 'key-1': {'n': 10},
+                              'key-2': {'n': 2}, 'key-3': {'n': 30},
+                              'key-4': {'n': 4}},
+                             dict(table.scan(batch_size=2)))
+            self.assertEqual({'n': 10}, tx.session['table1']['key-1'].doc)
+            self.assertNotIn('key-5', tx.session['table1'])
+
+        record = rethinkdb.table('transactions').get(pending).run(self.conn)
+        self.assertEqual('aborted', record['status'])
+
+    def test_between(self):
+        with rethinktx.Transaction(self.conn) as tx:
+            for i in range(5):
+                tx.table('table1').put('key-%d' % i, {'n': i})
+        rethinkdb.table('table1').index_create(
+            'n', rethinkdb.row['value']['n']).run(self.conn)
+
+        with rethinktx.Transaction(self.conn) as tx:
+            table = tx.table('table1')
+            self.assertEqual(['key-1', 'key-2'],
+                             sorted(key for key, _ in table.between(
+                                 'id', 'key-1', 'key-3')))
+            self.assertEqual({'key-3': {'n': 3}, 'key-4': {'n': 4}},
+                             dict(table.between('n', 3, rethinkdb.maxval,
+                                                memoize=False)))
+            self.assertNotIn('key-4', tx.session.get('table1', {}))
+
+    def test_between_rechecks_changed_documents(self):
+        with rethinktx.Transaction(self.conn) as tx:
+            for i in range(3):
+                tx.table('table1').put('key-%d' % i, {'n': i})
+        resolver = rethinktx.IntentResolver(lambda: self.conn, num_workers=0)
+        with rethinktx.Transaction(self.conn, resolver=resolver) as tx:
+            tx.table('table1').put('key-1', {'n': 100})
+        resolver.shutdown()
+
+        def index_fn(row):
+            return row['value']['n']
+
+        rethinkdb.table('table1').index_create('n', index_fn).run(self.conn)
+        with rethinktx.Transaction(self.conn) as tx:
+            table = tx.table('table1')
+            table.put('key-2', {'n': 50})
+            self.assertEqual({'key-0': {'n': 0}},
+                             dict(table.between('n', 0, 3,
+                                                index_fn=index_fn)))
+            self.assertEqual({'key-1': {'n': 100}},
+                             dict(table.between('n', 100, rethinkdb.maxval,
+                                                index_fn=index_fn)))
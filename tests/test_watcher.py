@@ -0,0 +1,81 @@
+# Copyright 2016, Anton Frolov <frolov.anton@gmail.com>
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+import time
+
+import rethinkdb
+import rethinktx
+from rethinktx import low_level
+from . import mocks
+
+import unittest
+
+
+class AbortWatcherTestCase(unittest.TestCase):
+    def setUp(self):
+        super(AbortWatcherTestCase, self).setUp()
+        self.conn = mocks.get_connection()
+        self.watcher = rethinktx.AbortWatcher(self._connect,
+                                              poll_interval=0.01)
+        self.assertTrue(self.watcher.ready.wait(5))
+
+    def tearDown(self):
+        super(AbortWatcherTestCase, self).tearDown()
+        self.watcher.shutdown()
+        mocks.cleanup_connection(self.conn)
+
+    def _connect(self):
+        return mocks.connect_like(self.conn)
+
+    def _wait_doomed(self, tx):
+        deadline = time.time() + 5
+        while not tx.doomed and time.time() < deadline:
+            time.sleep(0.01)
+        return tx.doomed
+
+    def test_aborted_transaction_fails_fast(self):
+        tx = rethinktx.Transaction(self.conn, watcher=self.watcher)
+        table = tx.table('table1')
+        table.put('key-1', 'data1')
+        self.assertTrue(low_level.abort(self.conn, tx.xid))
+        self.assertTrue(self._wait_doomed(tx))
+
+        with self.assertRaises(rethinktx.OptimisticLockFailure):
+            table.put('key-2', 'data2')
+        self.assertIsNone(
+            rethinkdb.table('table1').get('key-2').run(self.conn))
+        tx.abort()
+        record = rethinkdb.table('table1').get('key-1').run(self.conn)
+        self.assertIsNone(record['intent'])
+
+    def test_doomed_commit(self):
+        tx = rethinktx.Transaction(self.conn, buffered=True,
+                                   watcher=self.watcher)
+        tx.table('table1').put('key-1', 'data1')
+        tx._begin()
+        self.assertTrue(low_level.abort(self.conn, tx.xid))
+        self.assertTrue(self._wait_doomed(tx))
+
+        with self.assertRaises(rethinktx.OptimisticLockFailure):
+            tx.commit()
+        self.assertEqual('aborted', tx.state)
+        self.assertIsNone(
+            rethinkdb.table('table1').get('key-1').run(self.conn))
+
+    def test_finished_transactions_unwatched(self):
+        with rethinktx.Transaction(self.conn, watcher=self.watcher) as tx:
+            tx.table('table1').put('key-1', 'data1')
+        with rethinktx.Transaction(self.conn, watcher=self.watcher) as tx:
+            tx.table('table1').put('key-2', 'data2')
+            tx.abort()
+        self.assertEqual(0, len(self.watcher._watched))